@@ -3,7 +3,7 @@ import asyncio
 import logging
 import signal
 import sys
-import json
+import orjson
 from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
@@ -14,7 +14,6 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     CallbackQuery,
 )
-from aiogram.utils.markdown import hbold
 from dotenv import load_dotenv
 
 from google_calendar_client import GoogleCalendarClient
@@ -40,6 +39,41 @@ bot_service = BotService(db, calendar_client, bot)
 dp = Dispatcher()
 
 
+# Ограничение на количество пользователей, проверяемых одновременно
+check_semaphore = asyncio.Semaphore(int(os.getenv("CHECK_CONCURRENCY", 20)))
+
+
+async def run_blocking(func, *args):
+    """Выполняет синхронный запрос к базе в пуле потоков, не блокируя event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def check_user_meetings(user: int) -> None:
+    """Проверяет встречи одного пользователя и отправляет уведомления"""
+    async with check_semaphore:
+        (
+            success,
+            error_message,
+            meetings_by_day,
+            active_events,
+            deleted_events,
+            updated_events,
+        ) = await bot_service.get_check_meetings(user)
+        event_ids = tuple(event["id"] for event in active_events)
+        if updated_events:
+            await bot_service.send_updated_events(user, updated_events)
+        if deleted_events:
+            await bot_service.send_deleted_events(user, deleted_events)
+        if await run_blocking(
+            db.notifications.check_all_notifications_sent, event_ids, user
+        ):
+            return
+        await run_blocking(db.events.save_events_bulk, user, active_events)
+        await bot_service.send_meetings_check_by_day(user, meetings_by_day)
+        if not success:
+            await bot.send_message(user, error_message)
+
+
 # Функция для периодической отправки сообщений
 async def schedule_meetings_check():
     """"""
@@ -47,27 +81,16 @@ async def schedule_meetings_check():
         try:
             # Получаем всех пользователей из базы
             users = db.tokens.get_all_users()
-            for user in users:
-                (
-                    success,
-                    error_message,
-                    meetings_by_day,
-                    active_events,
-                    deleted_events,
-                    updated_events,
-                ) = await bot_service.get_check_meetings(user)
-                event_ids = tuple(event["id"] for event in active_events)
-                if updated_events:
-                    await bot_service.send_updated_events(user, updated_events)
-                if deleted_events:
-                    await bot_service.send_deleted_events(user, deleted_events)
-                if db.notifications.check_all_notifications_sent(event_ids, user):
-                    continue
-                for i in range(len(active_events)):
-                    status = db.events.save_event(user, active_events[i])
-                await bot_service.send_meetings_check_by_day(user, meetings_by_day)
-                if not success:
-                    await bot.send_message(user, error_message)
+            # Проверяем пользователей параллельно, чтобы запросы к Google не шли по очереди
+            results = await asyncio.gather(
+                *(check_user_meetings(user) for user in users),
+                return_exceptions=True,
+            )
+            for user, result in zip(users, results):
+                if isinstance(result, Exception):
+                    logging.error(
+                        f"Ошибка при проверке встреч пользователя {user}: {result}"
+                    )
         except Exception as e:
             logging.error(f"Ошибка при выполнении проверки встреч: {e}")
         await asyncio.sleep(int(os.getenv("CHECK_INTERVAL", 150)))
@@ -77,7 +100,7 @@ async def schedule_meetings_check():
 # Добавляем обработчик сигналов для корректного завершения
 async def on_shutdown(signal_type):
     """Корректное завершение работы бота при получении сигнала"""
-    logging.info(f"Получен сигнал {signal_type.name}, завершаю работу...")
+    logging.info("Получен сигнал %s, завершаю работу...", signal_type.name)
 
     # Закрываем соединения с базой данных
     db.db.close_all_sessions()
@@ -243,7 +266,10 @@ async def delete_specific_account(message: Message) -> None:
     # Извлекаем email из текста кнопки
     email = message.text.replace("❌ Удалить ", "")
     
-    if db.tokens.delete_token_by_email(message.from_user.id, email):
+    token_ids = db.tokens.delete_token_by_email(message.from_user.id, email)
+    if token_ids:
+        # Кэш синхронизации удаленного аккаунта больше не нужен
+        calendar_client.forget_tokens(*token_ids, email)
         await message.answer(
             f"Аккаунт {email} успешно удален.",
             reply_markup=KeyboardAccount().keyboard_account
@@ -384,19 +410,19 @@ async def statistics_command(message: Message) -> None:
     )
 
 
-@dp.callback_query(lambda c: json.loads(c.data).get("t") == "statistics")
+@dp.callback_query(lambda c: orjson.loads(c.data).get("t") == "statistics")
 async def process_statistics_callback(callback_query: CallbackQuery) -> None:
     """Обрабатывает нажатие кнопок статистики
     t - тип callback
     d - период
     """
-    data = json.loads(callback_query.data)
+    data = orjson.loads(callback_query.data)
     period = data.get("d")
-    logger.info(f"Получен период: {period}")
+    logger.info("Получен период: %s", period)
     user_id = callback_query.from_user.id
 
     await callback_query.answer()
-    statistics = bot_service.get_statistics(user_id, period)
+    statistics = await run_blocking(bot_service.get_statistics, user_id, period)
     await callback_query.message.edit_text(f"📊 Статистика за {period}:\n{statistics}")
 
 
@@ -420,9 +446,9 @@ async def check_command(message: Message) -> None:
     ) = await bot_service.get_check_meetings(message.from_user.id)
 
     event_ids = tuple(event["id"] for event in active_events)
-    logger.info(f"event_ids: {event_ids}")
+    logger.debug("event_ids: %d", len(event_ids))
     if deleted_events:
-        logger.info(f"deleted_events: {len(deleted_events)}")
+        logger.info("deleted_events: %s", len(deleted_events))
         await bot_service.send_deleted_events(message.from_user.id, deleted_events)
         await message_check.edit_text("Обнаружены удаленные встречи.")
         return
@@ -430,11 +456,12 @@ async def check_command(message: Message) -> None:
         await bot_service.send_updated_events(message.from_user.id, updated_events)
         await message_check.edit_text("Обнаружены обновленные встречи.")
         return
-    if db.notifications.check_all_notifications_sent(event_ids, message.from_user.id):
+    if await run_blocking(
+        db.notifications.check_all_notifications_sent, event_ids, message.from_user.id
+    ):
         await message_check.edit_text("Новых встреч не обнаружено.")
         return
-    for i in range(len(active_events)):
-        status = db.events.save_event(message.from_user.id, active_events[i])
+    await run_blocking(db.events.save_events_bulk, message.from_user.id, active_events)
     await bot_service.send_meetings_check_by_day(message.from_user.id, meetings_by_day)
     if not success:
         await message.answer(error_message)
@@ -500,12 +527,12 @@ async def check_week_meetings(message: Message) -> None:
         deleted_events,
         updated_events,
     ) = await bot_service.get_week_meetings(user_id)
-    logger.info(f"success: {success}")
-    logger.info(f"error_message: {error_message}")
-    logger.info(f"meetings_by_day: {meetings_by_day}")
-    logger.info(f"active_events: {len(active_events)}")
-    logger.info(f"deleted_events: {len(deleted_events)}")
-    logger.info(f"updated_events: {len(updated_events)}")
+    logger.info("success: %s", success)
+    logger.info("error_message: %s", error_message)
+    logger.debug("meetings_by_day: %d", len(meetings_by_day))
+    logger.info("active_events: %s", len(active_events))
+    logger.info("deleted_events: %s", len(deleted_events))
+    logger.info("updated_events: %s", len(updated_events))
     if not success:
         await message.answer(error_message)
         return
@@ -547,16 +574,16 @@ async def feedback_command(message: Message) -> None:
     )
 
 
-@dp.callback_query(lambda c: json.loads(c.data).get("t") == "f")
+@dp.callback_query(lambda c: orjson.loads(c.data).get("t") == "f")
 async def process_rating_callback(callback_query: CallbackQuery) -> None:
     """Обрабатывает нажатие кнопок рейтинга
     t - тип callback
     d - рейтинг
     m - id сообщения
     """
-    data = json.loads(callback_query.data)
+    data = orjson.loads(callback_query.data)
     rating = data.get("d")
-    logger.info(f"Получен рейтинг: {rating}")
+    logger.info("Получен рейтинг: %s", rating)
     user_id = callback_query.from_user.id
     message_id = data.get("m")
     await callback_query.answer()
@@ -589,7 +616,7 @@ async def info_command(message: Message) -> None:
 async def main() -> None:
     # Регистрируем обработчики сигналов
     for signal_type in (signal.SIGINT, signal.SIGTERM):
-        asyncio.get_event_loop().add_signal_handler(
+        asyncio.get_running_loop().add_signal_handler(
             signal_type, lambda s=signal_type: asyncio.create_task(on_shutdown(s))
         )
 
@@ -617,7 +644,7 @@ if __name__ == "__main__":
                 sys.exit(1)
             except OSError:
                 # Процесс не существует, можно продолжить
-                logging.warning(f"Найден устаревший файл блокировки. Перезаписываю.")
+                logging.warning("Найден устаревший файл блокировки. Перезаписываю.")
 
         # Записываем текущий PID в файл блокировки
         with open(lock_file, "w") as f:
@@ -1,5 +1,7 @@
 import logging
 import os
+from contextlib import contextmanager
+import orjson
 from sqlalchemy import (
     create_engine,
     Column,
@@ -9,18 +11,29 @@ from sqlalchemy import (
     Boolean,
     ForeignKey,
     JSON,
-    Table,
-    CheckConstraint,
+    Index,
+    delete,
+    event,
+    func,
+    inspect,
+    select,
     text,
 )
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship, scoped_session
+from sqlalchemy.orm import deferred, sessionmaker, relationship, scoped_session
 from datetime import datetime, timezone
-from typing import Any, TypeVar, Optional, Dict, Union
+from typing import Any, Iterator, TypeVar, Optional, Dict
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+def _json_dumps(value: Any) -> str:
+    """Сериализует JSON-колонки через orjson"""
+    return orjson.dumps(value).decode()
+
+
 # Создаем базовый класс для моделей
 Base = declarative_base()
 BaseType = TypeVar("BaseType", bound=Any)
@@ -80,7 +93,11 @@ class UserTokenLink(Base):
     user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
     token_id = Column(Integer, ForeignKey("tokens.id"), primary_key=True)
 
-    
+    __table_args__ = (
+        # Первичный ключ начинается с user_id; удаление и join по токену идут по token_id
+        Index("ix_user_tokens_link_token", "token_id"),
+    )
+
 
 class Token(Base):
     """Модель токена авторизации"""
@@ -89,14 +106,19 @@ class Token(Base):
 
     id = Column(Integer, primary_key=True)
     email = Column(String(255), nullable=True)  # Email, к которому привязан токен
-    token_data = Column(String(2048), nullable=False)  # Хранение токена в JSON формате
+    # Данные токена; на PostgreSQL хранятся в JSONB
+    token_data = Column(
+        JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=False
+    )
     status = Column(String(50), nullable=True)  # Статус токена
     redirect_url = Column(String(255), nullable=True)  # URL для перенаправления
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Время ставит сама БД: default попадает в INSERT и для уже созданных таблиц
+    created_at = Column(DateTime, default=func.now(), server_default=func.now())
     updated_at = Column(
         DateTime,
-        default=lambda: datetime.now(timezone.utc),
-        onupdate=lambda: datetime.now(timezone.utc),
+        default=func.now(),
+        server_default=func.now(),
+        onupdate=func.now(),
     )
     auth_message_id = Column(String(255), nullable=True)
     
@@ -127,10 +149,18 @@ class Event(Base):
         default=lambda: datetime.now(timezone.utc),
         onupdate=lambda: datetime.now(timezone.utc),
     )
-    all_data = Column(JSON, nullable=True)
+    # Полные данные события нужны только при сверке изменений, по умолчанию не грузим
+    all_data = deferred(Column(JSON, nullable=True))
+    # Хэш полей, которые сравниваются при проверке изменений события
+    content_hash = Column(String(16), nullable=True)
 
     token = relationship("Token", back_populates="events")  # Связь с токеном
 
+    __table_args__ = (
+        # События пользователя выбираются по его токенам в диапазоне дат
+        Index("ix_event_token_start", "token_id", "start_time"),
+    )
+
 
 class Notification(Base):
     """Модель уведомлений о событиях"""
@@ -146,6 +176,13 @@ class Notification(Base):
     event = relationship("Event")
     token = relationship("Token")
 
+    __table_args__ = (
+        # Одно уведомление на событие и токен, используется для ON CONFLICT
+        Index("ux_notification_event_token", "event_id", "token_id", unique=True),
+        # Уведомления аккаунта: проверки отправки и удаление вместе с токеном
+        Index("ix_notification_token_sent", "token_id", "is_sent"),
+    )
+
 class Feedback(Base):
     """Модель обратной связи"""
 
@@ -163,6 +200,11 @@ class Feedback(Base):
     )
     rating = Column(Integer, nullable=True)
 
+    __table_args__ = (
+        # Отзыв ищется по пользователю и сообщению, последний - по пользователю
+        Index("ix_feedback_user_message", "user_id", "message_id"),
+    )
+
 
 class Database:
     """Класс для работы с базой данных"""
@@ -176,7 +218,7 @@ class Database:
             # Если URL не найден в переменных окружения, используем SQLite как запасной вариант
             db_path = "/data/bot.db"
             db_url = f"sqlite:///{db_path}"
-            logger.warning(f"URL базы данных не указан, используем SQLite: {db_path}")
+            logger.warning("URL базы данных не указан, используем SQLite: %s", db_path)
         
         # Обработка переменных окружения в строке подключения
         if "${" in db_url:
@@ -184,13 +226,21 @@ class Database:
             
         # Настройки для PostgreSQL
         if db_url.startswith("postgresql"):
+            # LIFO держит небольшой набор "горячих" соединений, лишние закрываются по таймауту.
+            # Размер пула задается через окружение: он должен покрывать CHECK_CONCURRENCY
             self.engine = create_engine(
                 db_url,
                 echo=False,
-                pool_size=5,
-                max_overflow=10,
-                pool_timeout=30,
+                pool_size=int(os.environ.get("DB_POOL_SIZE") or 10),
+                max_overflow=int(os.environ.get("DB_MAX_OVERFLOW") or 20),
+                pool_timeout=10,
                 pool_recycle=1800,
+                pool_pre_ping=True,
+                pool_use_lifo=True,
+                query_cache_size=1200,
+                json_serializer=_json_dumps,
+                json_deserializer=orjson.loads,
+                future=True,
             )
         else:
             # Настройки для SQLite
@@ -198,13 +248,131 @@ class Database:
                 db_url,
                 echo=False,
                 connect_args={"check_same_thread": False},
+                query_cache_size=1200,
+                json_serializer=_json_dumps,
+                json_deserializer=orjson.loads,
+                future=True,
             )
+            event.listen(self.engine, "connect", self._set_sqlite_pragmas)
             
-        self.Session = scoped_session(sessionmaker(bind=self.engine))
+        # expire_on_commit=False: объекты остаются доступны после commit без повторного SELECT.
+        # Сессия используется как контекстный менеджер: with db.Session() as session
+        self.Session = scoped_session(
+            sessionmaker(bind=self.engine, expire_on_commit=False, future=True)
+        )
+        # Чтение идет через autocommit-соединения того же пула, без BEGIN/COMMIT
+        self.read_engine = self.engine.execution_options(isolation_level="AUTOCOMMIT")
+        self.ReadSession = scoped_session(
+            sessionmaker(
+                bind=self.read_engine,
+                autoflush=False,
+                expire_on_commit=False,
+                future=True,
+            )
+        )
 
         # Создаем таблицы, если они не существуют
         Base.metadata.create_all(self.engine)
-        logger.info(f"База данных инициализирована: {db_url}")
+        self._upgrade_columns()
+        self._remove_duplicate_notifications()
+        self._create_missing_indexes()
+        logger.info("База данных инициализирована: %s", db_url)
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+        """Включает WAL и ожидание блокировки для каждого нового соединения SQLite"""
+        cursor = dbapi_connection.cursor()
+        try:
+            # WAL позволяет читать параллельно с записью событий
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=5000")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+            cursor.execute("PRAGMA cache_size=-20000")
+            # Чтение страниц через mmap вместо копирования в буфер SQLite
+            cursor.execute("PRAGMA mmap_size=268435456")
+        finally:
+            cursor.close()
+
+    def _upgrade_columns(self) -> None:
+        """Приводит типы колонок существующих таблиц к текущим моделям"""
+        self._add_missing_columns()
+        # На SQLite JSON хранится как TEXT, старые строки читаются без миграции
+        if self.engine.dialect.name != "postgresql":
+            return
+        columns = {
+            column["name"]: column["type"]
+            for column in inspect(self.engine).get_columns("tokens")
+        }
+        if isinstance(columns.get("token_data"), postgresql.JSONB):
+            return
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "ALTER TABLE tokens ALTER COLUMN token_data "
+                        "TYPE JSONB USING token_data::jsonb"
+                    )
+                )
+            logger.info("Колонка tokens.token_data переведена в JSONB")
+        except SQLAlchemyError as e:
+            logger.warning("Не удалось перевести tokens.token_data в JSONB: %s", e)
+
+    def _add_missing_columns(self) -> None:
+        """Добавляет в существующие таблицы nullable-колонки, появившиеся в моделях"""
+        # create_all не меняет уже созданные таблицы
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                try:
+                    with self.engine.begin() as connection:
+                        connection.execute(
+                            text(
+                                f"ALTER TABLE {table.name} "
+                                f"ADD COLUMN {column.name} {column_type}"
+                            )
+                        )
+                    logger.info("Добавлена колонка %s.%s", table.name, column.name)
+                except SQLAlchemyError as e:
+                    logger.warning(
+                        "Не удалось добавить колонку %s.%s: %s",
+                        table.name,
+                        column.name,
+                        e,
+                    )
+
+    def _remove_duplicate_notifications(self) -> None:
+        """Удаляет повторные уведомления перед созданием уникального индекса"""
+        # Старые версии вставляли уведомления без ограничения уникальности;
+        # без индекса ON CONFLICT (event_id, token_id) отклоняется PostgreSQL
+        indexes = {
+            index["name"] for index in inspect(self.engine).get_indexes("notifications")
+        }
+        if "ux_notification_event_token" in indexes:
+            return
+        keep_ids = select(func.min(Notification.id)).group_by(
+            Notification.event_id, Notification.token_id
+        )
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                delete(Notification).where(Notification.id.not_in(keep_ids))
+            )
+        if result.rowcount:
+            logger.info("Удалено повторных уведомлений: %d", result.rowcount)
+
+    def _create_missing_indexes(self) -> None:
+        """Создает индексы, которых нет в уже существующих таблицах"""
+        # create_all не добавляет новые индексы в существующие таблицы
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(self.engine, checkfirst=True)
+                except SQLAlchemyError as e:
+                    logger.warning("Не удалось создать индекс %s: %s", index.name, e)
 
     def _process_env_vars(self, url: str) -> str:
         """Обрабатывает переменные окружения в строке подключения"""
@@ -218,10 +386,36 @@ class Database:
         processed_url = re.sub(r'\${([^}]+)}', replace_env_var, url)
         return processed_url
 
+    def insert(self, model: Any) -> Any:
+        """Возвращает INSERT с поддержкой ON CONFLICT для текущего диалекта"""
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(model)
+        return sqlite.insert(model)
+
     def get_session(self) -> Any:
         """Возвращает новую сессию базы данных"""
         return self.Session()
 
+    @contextmanager
+    def session_scope(self) -> Iterator[Any]:
+        """Сессия-транзакция: commit при успехе, rollback при ошибке, затем close"""
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def new_session(self, readonly: bool = False) -> Any:
+        """Возвращает отдельную сессию, не связанную с потоковой scoped-сессией"""
+        if readonly:
+            return self.ReadSession.session_factory()
+        return self.Session.session_factory()
+
     def close_all_sessions(self) -> None:
         """Закрывает все сессии"""
         self.Session.remove()
+        self.ReadSession.remove()
@@ -1,17 +1,20 @@
 import os
 import asyncio
-import json
+import copy
+import orjson
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from requests_oauthlib import OAuth2Session
 
 from queries import DatabaseQueries
+from utils import parse_event_time
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +22,9 @@ logger = logging.getLogger(__name__)
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly", 
           "https://www.googleapis.com/auth/userinfo.email"]  # Добавляем scope для доступа к email
 
+# Запас времени до истечения access token, при котором кэш Credentials не используется
+CREDS_EXPIRY_MARGIN = timedelta(seconds=60)
+
 
 class GoogleCalendarClient:
     """Класс для работы с Google Calendar API"""
@@ -26,6 +32,53 @@ class GoogleCalendarClient:
     def __init__(self, db: DatabaseQueries):
         self.db = db
         self.credentials_file = "credentials.json"
+        # Конфигурация OAuth-клиента читается с диска один раз
+        self._client_config: Optional[Dict[str, Any]] = self._load_client_config()
+        # Ограничивает число одновременных запросов к Google Calendar API
+        self._poll_sem = asyncio.Semaphore(20)
+        # Состояние инкрементальной синхронизации по каждому токену:
+        # syncToken, окно полной синхронизации и известные события окна
+        self._sync_state: Dict[Any, Dict[str, Any]] = {}
+        # Кэш собранных Credentials (версия строки токена, Credentials),
+        # пока access token не истек
+        self._creds_cache: Dict[Any, Tuple[Any, Credentials]] = {}
+
+    def forget_tokens(self, *token_keys: Any) -> None:
+        """Сбрасывает состояние синхронизации и Credentials удаленных токенов"""
+        for key in token_keys:
+            self._sync_state.pop(key, None)
+            self._creds_cache.pop(("token", key), None)
+
+    def _load_client_config(self) -> Optional[Dict[str, Any]]:
+        """Читает конфигурацию OAuth-клиента из credentials.json"""
+        if not os.path.exists(self.credentials_file):
+            return None
+        try:
+            with open(self.credentials_file, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.error(f"Ошибка при чтении {self.credentials_file}: {e}")
+            return None
+
+    def _create_flow(self, redirect_uri: str) -> InstalledAppFlow:
+        """Создает flow авторизации из закэшированной конфигурации клиента"""
+        # flow изменяет client_config, поэтому передаем копию
+        return InstalledAppFlow.from_client_config(
+            copy.deepcopy(self._client_config), SCOPES, redirect_uri=redirect_uri
+        )
+
+    def _get_cached_creds(self, key: Any, version: Any) -> Optional[Credentials]:
+        """Возвращает Credentials из кэша, если access token еще действителен"""
+        cached = self._creds_cache.get(key)
+        if cached is None or cached[0] != version:
+            return None
+        creds = cached[1]
+        # expiry в google-auth хранится как naive datetime в UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if creds.expiry is None or creds.expiry <= now + CREDS_EXPIRY_MARGIN:
+            self._creds_cache.pop(key, None)
+            return None
+        return creds
 
     async def get_credentials(self, user_id: int) -> Optional[Credentials]:
         """Получение и обновление учетных данных Google."""
@@ -41,26 +94,24 @@ class GoogleCalendarClient:
             if creds and creds.expired and creds.refresh_token:
                 creds.refresh(Request())
                 # Сохраняем обновленные учетные данные
-                self.db.tokens.save_token(user_id, json.loads(creds.to_json()))
+                self.db.tokens.save_token(user_id, orjson.loads(creds.to_json()))
             else:
-                logger.info(f"Учетные данные не найдены для пользователя: {user_id}")
+                logger.info("Учетные данные не найдены для пользователя: %s", user_id)
                 return None
 
-        logger.info(f"Учетные данные найдены для пользователя: {user_id}")
+        logger.info("Учетные данные найдены для пользователя: %s", user_id)
         return creds
 
     def create_auth_url(self, user_id: int) -> str:
         """Создает URL для авторизации и сохраняет состояние."""
         try:
             # Проверяем наличие файла credentials.json
-            if not os.path.exists(self.credentials_file):
+            if self._client_config is None:
                 logging.error(f"Файл {self.credentials_file} не найден")
                 return f"Ошибка: файл {self.credentials_file} не найден"
 
             # Создаем flow
-            flow = InstalledAppFlow.from_client_secrets_file(
-                self.credentials_file,
-                SCOPES,
+            flow = self._create_flow(
                 redirect_uri="urn:ietf:wg:oauth:2.0:oob",  # Используем OOB для надежности
             )
 
@@ -82,7 +133,7 @@ class GoogleCalendarClient:
             state_auth, message = self.db.tokens.save_auth_state(user_id, flow_state, flow.redirect_uri, "auth")
             if not state_auth:
                 return message
-            logger.info(f"URL авторизации создан для пользователя: {user_id}")
+            logger.info("URL авторизации создан для пользователя: %s", user_id)
             return auth_url
         except Exception as e:
             logging.error(f"Ошибка при создании URL авторизации: {e}")
@@ -96,16 +147,14 @@ class GoogleCalendarClient:
             # Получаем сохраненное состояние
             flow_state, redirect_uri = self.db.tokens.get_auth_state(user_id)
             if not flow_state:
-                logger.info(f"Сессия авторизации истекла для пользователя: {user_id}")
+                logger.info("Сессия авторизации истекла для пользователя: %s", user_id)
                 return (
                     False,
                     "Сессия авторизации истекла. Пожалуйста, начните заново с команды /auth",
                 )
 
             # Создаем новый flow с сохраненными scopes
-            flow = InstalledAppFlow.from_client_secrets_file(
-                self.credentials_file, SCOPES, redirect_uri=redirect_uri
-            )
+            flow = self._create_flow(redirect_uri=redirect_uri)
 
             # Обновляем конфигурацию flow
             flow.client_config.update(
@@ -164,18 +213,22 @@ class GoogleCalendarClient:
                 user_info = service.userinfo().get().execute()
                 email = user_info.get('email')
             except Exception as e:
-                logger.warning(f"Не удалось получить email пользователя: {e}")
+                logger.warning("Не удалось получить email пользователя: %s", e)
                 email = None
 
             # Сохраняем учетные данные и email
-            token_data = json.loads(creds.to_json())
+            token_data = orjson.loads(creds.to_json())
             if email:
                 token_data['email'] = email
             
             success, message = self.db.tokens.save_token(user_id, token_data)
             if not success:
                 return False, message
-            logger.info(f"Учетные данные сохранены для пользователя: {user_id} с email: {email}")
+            logger.info(
+                "Учетные данные сохранены для пользователя: %s с email: %s",
+                user_id,
+                email,
+            )
             return (
                 True,
                 "✅ Авторизация успешно завершена! Теперь вы можете использовать команды бота.",
@@ -193,19 +246,27 @@ class GoogleCalendarClient:
         timezone_str: str = "UTC",
     ) -> List[Dict[str, Any]]:
         """Получение предстоящих событий из Google Calendar для всех токенов пользователя."""
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         all_events = []
-        logger.info(f"Получение предстоящих событий для пользователя: {user_id}")
+        logger.info("Получение предстоящих событий для пользователя: %s", user_id)
         # Получаем все токены пользователя
         user_tokens = self.db.tokens.get_all_tokens(user_id)
-        logger.info(f"Найдено {len(user_tokens)} токенов для пользователя: {user_id}")
+        logger.info(
+            "Найдено %s токенов для пользователя: %s", len(user_tokens), user_id
+        )
         if not user_tokens:
-            logger.info(f"Токены не найдены для пользователя: {user_id}")
+            logger.info("Токены не найдены для пользователя: %s", user_id)
             return []
         for token_obj in user_tokens:
             try:
                 # Обработка объекта Token
                 token_email = None  # Для логов
+
+                token_id = None
+                if hasattr(token_obj, 'id'):
+                    token_id = token_obj.id
+                elif isinstance(token_obj, dict) and 'id' in token_obj:
+                    token_id = token_obj['id']
                 
                 # Проверяем структуру данных токена
                 if hasattr(token_obj, 'token_data'):
@@ -222,7 +283,9 @@ class GoogleCalendarClient:
                     token_email = token_obj.get('email', 'без email')
                 else:
                     # Используем сам объект, если нет атрибута token_data
-                    logger.warning(f"Не найден атрибут 'token_data' в токене, используем сам объект")
+                    logger.warning(
+                        "Не найден атрибут 'token_data' в токене, используем сам объект"
+                    )
                     if hasattr(token_obj, '__dict__'):
                         token_data = token_obj.__dict__.copy()
                         if '_sa_instance_state' in token_data:
@@ -241,20 +304,27 @@ class GoogleCalendarClient:
                 # Если token_data это строка (например, JSON), пробуем преобразовать в словарь
                 if isinstance(token_data, str):
                     try:
-                        token_data = json.loads(token_data)
+                        token_data = orjson.loads(token_data)
                     except Exception as e:
                         logger.error(f"Ошибка при преобразовании JSON строки в словарь: {e}")
                         continue
                 
-                # Создаем учетные данные из токена
+                # Создаем учетные данные из токена, если в кэше нет действительных
+                creds_key = ("token", token_id) if token_id is not None else None
+                creds_version = getattr(token_obj, 'updated_at', None)
+                creds = (
+                    self._get_cached_creds(creds_key, creds_version)
+                    if creds_key
+                    else None
+                )
                 try:
-                    creds = Credentials.from_authorized_user_info(token_data, SCOPES)
+                    if creds is None:
+                        creds = Credentials.from_authorized_user_info(token_data, SCOPES)
                 except Exception as e:
                     logger.error(f"Ошибка при создании Credentials: {e}")
                     # Пробуем прочитать данные из файла учетных данных
                     try:
-                        with open(self.credentials_file, 'r') as f:
-                            client_config = json.load(f)
+                        client_config = self._client_config or {}
                         
                         if 'installed' in client_config:
                             client_id = client_config['installed']['client_id']
@@ -284,16 +354,22 @@ class GoogleCalendarClient:
                     if creds and creds.expired and creds.refresh_token:
                         creds.refresh(Request())
                         # Сохраняем обновленные учетные данные
-                        self.db.tokens.save_token(user_id, json.loads(creds.to_json()))
-                        logger.info(f"Обновленные учетные данные сохранены для пользователя: {user_id}")
+                        self.db.tokens.save_token(user_id, orjson.loads(creds.to_json()))
+                        logger.info(
+                            "Обновленные учетные данные сохранены для пользователя: %s",
+                            user_id,
+                        )
                     else:
-                        logger.info(f"Невалидный токен для пользователя: {user_id}")
+                        logger.info("Невалидный токен для пользователя: %s", user_id)
                         continue
+                if creds_key:
+                    self._creds_cache[creds_key] = (creds_version, creds)
                 
                 # Создаем сервис
-                service = await loop.run_in_executor(
-                    None, lambda: build("calendar", "v3", credentials=creds)
-                )
+                async with self._poll_sem:
+                    service = await loop.run_in_executor(
+                        None, lambda: build("calendar", "v3", credentials=creds)
+                    )
                 
                 # Убедимся, что у datetime есть timezone и преобразуем в UTC
                 if time_min.tzinfo is None:
@@ -314,41 +390,36 @@ class GoogleCalendarClient:
                 time_min_str = time_min.strftime("%Y-%m-%dT%H:%M:%SZ")
                 time_max_str = time_max.strftime("%Y-%m-%dT%H:%M:%SZ")
                 
-                logger.info(f"Запрашиваем события с {time_min_str} по {time_max_str} для токена {token_email}")
+                logger.info(
+                    "Запрашиваем события с %s по %s для токена %s",
+                    time_min_str,
+                    time_max_str,
+                    token_email,
+                )
                 
                 # Вызываем API
-                events_result = await loop.run_in_executor(
-                    None,
-                    lambda: service.events()
-                    .list(
-                        calendarId="primary",
-                        timeMin=time_min_str,
-                        timeMax=time_max_str,
-                        maxResults=limit,
-                        singleEvents=True,
-                        orderBy="startTime",
-                        timeZone=timezone_str,
-                    )
-                    .execute(),
+                events = await self._sync_events(
+                    service,
+                    token_id if token_id is not None else token_email,
+                    time_min,
+                    time_max,
+                    limit,
+                    timezone_str,
                 )
-                
-                events = events_result.get("items", [])
                 # Фильтруем только события с видеовстречами
                 events = [event for event in events if "hangoutLink" in event]
                 
                 # Добавляем информацию о токене к каждому событию
-                token_id = None
-                if hasattr(token_obj, 'id'):
-                    token_id = token_obj.id
-                elif isinstance(token_obj, dict) and 'id' in token_obj:
-                    token_id = token_obj['id']
-                    
                 for event in events:
                     event["token_id"] = token_id
                     event["token_email"] = token_email
                 
                 all_events.extend(events)
-                logger.info(f"Получено {len(events)} событий из календаря для токена {token_email}")
+                logger.info(
+                    "Получено %s событий из календаря для токена %s",
+                    len(events),
+                    token_email,
+                )
             
             except Exception as e:
                 # Пытаемся получить email для логирования
@@ -363,5 +434,85 @@ class GoogleCalendarClient:
                 logger.error(f"Ошибка при получении событий для токена {token_email}: {e}")
                 continue
         
-        logger.info(f"Всего получено {len(all_events)} событий из всех календарей пользователя {user_id}")
+        logger.info(
+            "Всего получено %s событий из всех календарей пользователя %s",
+            len(all_events),
+            user_id,
+        )
         return all_events
+
+    async def _sync_events(
+        self,
+        service: Any,
+        token_key: Any,
+        time_min: datetime,
+        time_max: datetime,
+        limit: int,
+        timezone_str: str,
+    ) -> List[Dict[str, Any]]:
+        """Возвращает события окна, запрашивая у Google только изменения по syncToken."""
+        loop = asyncio.get_running_loop()
+        state = self._sync_state.get(token_key)
+        params: Dict[str, Any] = {
+            "calendarId": "primary",
+            "singleEvents": True,
+            "maxResults": 250,
+            "timeZone": timezone_str,
+        }
+        # syncToken действует только для окна, в котором была полная синхронизация
+        if state and state["time_min"] <= time_min and time_max <= state["time_max"]:
+            params["syncToken"] = state["sync_token"]
+            known_events = state["events"]
+        else:
+            params["timeMin"] = time_min.strftime("%Y-%m-%dT%H:%M:%SZ")
+            params["timeMax"] = time_max.strftime("%Y-%m-%dT%H:%M:%SZ")
+            state = {"time_min": time_min, "time_max": time_max}
+            known_events = {}
+
+        page_token = None
+        while True:
+            try:
+                async with self._poll_sem:
+                    events_result = await loop.run_in_executor(
+                        None,
+                        lambda: service.events()
+                        .list(pageToken=page_token, **params)
+                        .execute(),
+                    )
+            except HttpError as e:
+                if e.resp.status == 410 and "syncToken" in params:
+                    # syncToken устарел, повторяем полную синхронизацию
+                    logger.info("syncToken устарел для токена %s", token_key)
+                    self._sync_state.pop(token_key, None)
+                    return await self._sync_events(
+                        service, token_key, time_min, time_max, limit, timezone_str
+                    )
+                raise
+
+            for item in events_result.get("items", []):
+                if item.get("status") == "cancelled":
+                    known_events.pop(item["id"], None)
+                else:
+                    known_events[item["id"]] = item
+
+            page_token = events_result.get("nextPageToken")
+            if not page_token:
+                break
+
+        if "syncToken" not in params:
+            logger.info("Полная синхронизация событий для токена %s", token_key)
+        state["sync_token"] = events_result.get("nextSyncToken")
+        state["events"] = known_events
+        if state["sync_token"]:
+            self._sync_state[token_key] = state
+
+        # Повторяем фильтрацию и сортировку, которые раньше делал запрос с timeMin/timeMax
+        window_events = []
+        for event in known_events.values():
+            # Ключ разбора тот же, что и в сервисах, поэтому там дата берется из кэша
+            start_dt = parse_event_time(event, "start")
+            if parse_event_time(event, "end") > time_min and start_dt < time_max:
+                window_events.append((start_dt, event))
+        window_events.sort(key=lambda item: item[0])
+        # Вызывающий код изменяет события, поэтому сохраненные копии не отдаем
+        return [copy.deepcopy(event) for _, event in window_events[:limit]]
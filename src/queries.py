@@ -1,17 +1,142 @@
 import abc
 import logging
-import json
-import pytz
 from datetime import datetime, timezone, timedelta
-from typing import Any, Optional, List, Dict, Union
-from sqlalchemy.orm import Session
+from typing import Any, Iterator
+from sqlalchemy import (
+    DateTime,
+    and_,
+    bindparam,
+    delete,
+    func,
+    literal,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.orm import Session, joinedload, load_only
 from sqlalchemy.exc import SQLAlchemyError
 
 from database import Database, User, Token, Event, Notification, Feedback, UserTokenLink
-from utils import safe_parse_datetime
+from utils import (
+    MISSING,
+    TTLCache,
+    event_content_hash,
+    from_naive_utc,
+    parse_event_time,
+    to_naive_utc,
+)
 
 logger = logging.getLogger(__name__)
 
+# Колонки событий, достаточные для вывода списка ближайших встреч
+UPCOMING_EVENT_COLUMNS = (
+    Event.event_id,
+    Event.title,
+    Event.start_time,
+    Event.end_time,
+    Event.meet_link,
+)
+
+# Колонки строк событий при потоковом чтении, без загрузки ORM-объектов
+EVENT_ROW_COLUMNS = (
+    Event.id,
+    Event.title,
+    Event.start_time,
+    Event.end_time,
+    Event.meet_link,
+)
+
+# Колонки объектов Event, которые нужны при работе со списком событий
+EVENT_LOAD_COLUMNS = UPCOMING_EVENT_COLUMNS + (Event.id, Event.token_id)
+
+# Размер пачки в многострочном INSERT, чтобы не упираться в лимит параметров SQLite
+BULK_CHUNK_SIZE = 500
+
+# Запросы горячих путей собираются один раз, параметры передаются через bindparam
+_GET_USER_STMT = select(User).where(User.id == bindparam("user_id"))
+_GET_USER_IDS_STMT = select(User.id)
+_USER_TOKEN_IDS_STMT = select(UserTokenLink.token_id).where(
+    UserTokenLink.user_id == bindparam("user_id")
+)
+_GET_USER_TOKENS_STMT = (
+    select(Token)
+    .join(UserTokenLink, UserTokenLink.token_id == Token.id)
+    .where(UserTokenLink.user_id == bindparam("user_id"))
+)
+_TOKEN_BUNDLE_STMT = select(
+    Token.id,
+    Token.token_data,
+    Token.redirect_url,
+    Token.auth_message_id,
+).join(UserTokenLink, UserTokenLink.token_id == Token.id)
+_GET_TOKEN_BUNDLE_STMT = _TOKEN_BUNDLE_STMT.where(
+    UserTokenLink.user_id == bindparam("user_id")
+).limit(1)
+_GET_TOKEN_BUNDLE_BY_STATUS_STMT = _TOKEN_BUNDLE_STMT.where(
+    UserTokenLink.user_id == bindparam("user_id"),
+    Token.status == bindparam("status"),
+).limit(1)
+# Уведомление ищется по событию и токену, которому это событие принадлежит
+_GET_NOTIFICATION_STMT = (
+    select(Notification)
+    .join(
+        Event,
+        and_(
+            Event.event_id == Notification.event_id,
+            Event.token_id == Notification.token_id,
+        ),
+    )
+    .where(Notification.event_id == bindparam("event_id"))
+    .limit(1)
+)
+_GET_NOTIFIED_EVENT_IDS_STMT = select(Notification.event_id).join(
+    Event,
+    and_(
+        Event.event_id == Notification.event_id,
+        Event.token_id == Notification.token_id,
+    ),
+).where(Notification.event_id.in_(bindparam("event_ids", expanding=True)))
+_GET_PENDING_NOTIFICATIONS_STMT = select(Notification).where(
+    Notification.is_sent == False
+)
+_GET_SENT_EVENT_IDS_STMT = (
+    select(Notification.event_id)
+    .where(
+        Notification.event_id.in_(bindparam("event_ids", expanding=True)),
+        Notification.token_id.in_(_USER_TOKEN_IDS_STMT),
+        Notification.is_sent == True,
+    )
+    .distinct()
+)
+# Пакетные UPDATE событий по первичному ключу, выполняются через executemany
+_events_table = Event.__table__
+_UPDATE_EVENT_STMT = (
+    update(_events_table)
+    .where(_events_table.c.id == bindparam("b_id"))
+    .values(
+        title=bindparam("b_title"),
+        start_time=bindparam("b_start_time"),
+        end_time=bindparam("b_end_time"),
+        meet_link=bindparam("b_meet_link"),
+        all_data=bindparam("b_all_data", type_=_events_table.c.all_data.type),
+        content_hash=bindparam("b_content_hash"),
+    )
+)
+_SET_EVENT_HASH_STMT = (
+    update(_events_table)
+    .where(_events_table.c.id == bindparam("b_id"))
+    .values(content_hash=bindparam("b_hash"))
+)
+_SET_AUTH_MESSAGE_ID_STMT = (
+    update(Token)
+    .where(
+        Token.id.in_(_USER_TOKEN_IDS_STMT),
+        Token.status == "auth",
+    )
+    .values(auth_message_id=bindparam("auth_message_id"))
+    .execution_options(synchronize_session=False)
+)
+
 
 class Queries(abc.ABC):
     def __init__(self, db: Database):
@@ -20,352 +145,399 @@ class Queries(abc.ABC):
 
 class FeedbackQueries(Queries):
 
+    def update_feedback(
+        self,
+        user_id: int,
+        message_id: int,
+        rating: int | None = None,
+        content: str | None = None,
+    ) -> bool:
+        """Обновляет переданные поля обратной связи одним UPDATE"""
+        values: dict[str, Any] = {}
+        if rating is not None:
+            values["rating"] = rating
+        if content is not None:
+            values["content"] = content
+        if not values:
+            return False
+        try:
+            with self.db.session_scope() as session:
+                # Отсутствие записи видно по rowcount, без предварительного SELECT
+                result = session.execute(
+                    update(Feedback)
+                    .where(
+                        Feedback.user_id == user_id, Feedback.message_id == message_id
+                    )
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при обновлении обратной связи: {e}")
+            return False
+        if not result.rowcount:
+            logger.warning("Обратная связь не найдена для юзера: %s", user_id)
+            return False
+        logger.info(
+            "Обратная связь обновлена для юзера: %s (%s)", user_id, ", ".join(values)
+        )
+        return True
+
     def set_rating(self, user_id: int, rating: int, message_id: int) -> None:
         """Устанавливает рейтинг"""
-        session = self.db.get_session()
-        try:
-            feedback = (
-                session.query(Feedback)
-                .filter(Feedback.user_id == user_id, Feedback.message_id == message_id)
-                .first()
-            )
-            feedback.rating = rating
-            logger.info(f"Rating: {feedback.rating} от юзера: {user_id}")
-            session.commit()
-        except Exception as e:
-            logger.error(f"Ошибка при установке рейтинга: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        self.update_feedback(user_id, message_id, rating=rating)
 
     def get_feedback_message_id(self, user_id: int) -> int | None:
         """Получает ID сообщения обратной связи"""
-        session = self.db.get_session()
-        try:
-            feedback = (
-                session.query(Feedback)
-                .filter(Feedback.user_id == user_id)
-                .order_by(Feedback.created_at.desc())
-                .first()
-            )
-            logger.info(f"Message ID: {feedback.message_id} для юзера: {user_id}")
-            return feedback.message_id if feedback else None
-        except Exception as e:
-            logger.error(f"Ошибка при получении ID сообщения обратной связи: {e}")
-            return None
-        finally:
-            session.close()
+        with self.db.ReadSession() as session:
+            try:
+                feedback = (
+                    session.query(Feedback)
+                    .filter(Feedback.user_id == user_id)
+                    .order_by(Feedback.created_at.desc())
+                    .first()
+                )
+                if not feedback:
+                    logger.info("Обратная связь не найдена для юзера: %s", user_id)
+                    return None
+                logger.info(
+                    "Message ID: %s для юзера: %s", feedback.message_id, user_id
+                )
+                return feedback.message_id
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении ID сообщения обратной связи: {e}")
+                return None
 
     def create_feedback_message_id(self, user_id: int, message_id: int) -> None:
         """Устанавливает ID сообщения обратной связи"""
-        session = self.db.get_session()
         try:
-            feedback = Feedback(user_id=user_id, message_id=message_id)
-            session.add(feedback)
-            session.commit()
-            logger.info(f"ID сообщения {message_id} установлен для юзера: {user_id}")
-        except Exception as e:
+            with self.db.session_scope() as session:
+                session.add(Feedback(user_id=user_id, message_id=message_id))
+            logger.info("ID сообщения %s установлен для юзера: %s", message_id, user_id)
+        except SQLAlchemyError as e:
             logger.error(f"Ошибка при создании обратной связи: {e}")
-            session.rollback()
-        finally:
-            session.close()
 
     def set_content_feedback(self, user_id: int, message_id: int, content: str) -> None:
         """Сохраняет обратную связь"""
-        session = self.db.get_session()
-        try:
-            feedback = (
-                session.query(Feedback)
-                .filter(Feedback.user_id == user_id, Feedback.message_id == message_id)
-                .first()
-            )
-            logger.info(f"Обратная связь найденная: {feedback}")
-            logger.info(f"Обратная связь: {content}")
-            feedback.content = content
-            session.commit()
-            logger.info(f"Обратная связь установлена для юзера: {user_id}")
-        except Exception as e:
-            logger.error(f"Ошибка при создании обратной связи: {e}")
-            session.rollback()
-        finally:
-            session.close()
+        self.update_feedback(user_id, message_id, content=content)
 
 
 class UserQueries(Queries):
+    # Кэш пользователей по id, общий для всех экземпляров; хранит и промахи
+    _user_cache = TTLCache(maxsize=10_000, ttl=60)
 
-    def add_user(self, user_data: dict | int) -> User | None:
+    def add_user(self, user_data: dict | int) -> bool:
         """Добавляет нового пользователя в базу данных"""
-        session = self.db.get_session()
-        try:
-            # Проверяем, является ли user_data целым числом (ID пользователя)
-            if isinstance(user_data, int):
-                # Проверяем существует ли пользователь
-                existing_user = session.query(User).filter(User.id == user_data).first()
-                if existing_user:
-                    logger.info(f"Пользователь с ID {user_data} уже существует")
-                    return existing_user
-                else:
-                    logger.error(f"Пользователь с ID {user_data} не найден и нет данных для создания")
-                    return None
-            
+        # Проверяем, является ли user_data целым числом (ID пользователя)
+        if isinstance(user_data, int):
             # Проверяем существует ли пользователь
-            existing_user = session.query(User).filter(User.id == user_data["id"]).first()
-            if existing_user:
-                # Обновляем существующего пользователя
-                existing_user.username = user_data.get("username", existing_user.username)
-                existing_user.full_name = user_data.get("full_name", existing_user.full_name)
-                existing_user.is_bot = user_data.get("is_bot", existing_user.is_bot)
-                existing_user.language_code = user_data.get("language_code", existing_user.language_code)
+            if self.get_user(user_data) is not None:
+                logger.info("Пользователь с ID %s уже существует", user_data)
+                return True
+            logger.error(
+                f"Пользователь с ID {user_data} не найден и нет данных для создания"
+            )
+            return False
+        with self.db.Session() as session:
+            try:
+                # Вставляем пользователя или обновляем переданные поля одним запросом
+                user = User.from_dict(user_data)
+                stmt = self.db.insert(User).values(
+                    id=user.id,
+                    username=user.username,
+                    full_name=user.full_name,
+                    is_bot=user.is_bot,
+                    language_code=user.language_code,
+                    created_at=datetime.now(timezone.utc),
+                    is_active=True,
+                )
+                update_fields = {
+                    field: getattr(stmt.excluded, field)
+                    for field in ("username", "full_name", "is_bot", "language_code")
+                    if field in user_data
+                }
+                if update_fields:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[User.id], set_=update_fields
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[User.id])
+                session.execute(stmt)
                 session.commit()
-                logger.info(f"Обновлен пользователь: {existing_user}")
-                return session.merge(existing_user)
-
-            # Создаем нового пользователя
-            user = User.from_dict(user_data)
-            session.add(user)
-            session.commit()
-            # Возвращаем объект, привязанный к сессии
-            logger.info(f"Успешно добавлен пользователь: {user}")
-            return session.merge(user)
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при добавлении пользователя: {e}")
-            return None
-        finally:
-            session.close()
+                self._user_cache.pop(user.id)
+                logger.info("Успешно сохранен пользователь: %s", user.id)
+                return True
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка при добавлении пользователя: {e}")
+                return False
 
     def get_user(self, user_id: int) -> Any:
         """Получает пользователя по ID"""
-        session = self.db.get_session()
-        try:
-            user = session.query(User).filter(User.id == user_id).first()
-            logger.error(f"Успешно получен пользователь: {user}")
-            return user
-        except Exception as e:
-            logger.error(f"Ошибка при получении пользователя: {e}")
-            return None
-        finally:
-            session.close()
+        cached = self._user_cache.get(user_id)
+        if cached is not MISSING:
+            return cached
+        with self.db.ReadSession() as session:
+            try:
+                user = session.execute(
+                    _GET_USER_STMT, {"user_id": user_id}
+                ).scalar_one_or_none()
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении пользователя: {e}")
+                return None
+        self._user_cache.set(user_id, user)
+        logger.debug("Успешно получен пользователь: %s", user_id)
+        return user
 
 
 class TokenQueries(Queries):
+    # Кэш токенов по (user_id, status), общий для всех экземпляров; хранит и промахи
+    _bundle_cache = TTLCache(maxsize=10_000, ttl=30)
+    _BUNDLE_STATUSES = (None, "auth", "ready")
+
+    def _invalidate_token_cache(self, *user_ids: int) -> None:
+        """Сбрасывает закэшированные токены пользователей после изменения"""
+        for user_id in user_ids:
+            for status in self._BUNDLE_STATUSES:
+                self._bundle_cache.pop((user_id, status))
 
     def get_all_tokens(self, user_id: int) -> Any:
         """Получает все токены"""
-        session = self.db.get_session()
-        try:
-            tokens = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id).all()
-            return tokens
-        except Exception as e:
-            logger.error(f"Ошибка при получении всех токенов: {e}")
-            return []
-        finally:
-            session.close()
+        with self.db.ReadSession() as session:
+            try:
+                return (
+                    session.execute(_GET_USER_TOKENS_STMT, {"user_id": user_id})
+                    .scalars()
+                    .all()
+                )
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении всех токенов: {e}")
+                return []
     
     
-    def get_all_users(self) -> Any:
-        """Получает всех пользователей"""
-        session = self.db.get_session()
-        try:
-            users = session.query(User).all()
-            list_users = [user.id for user in users]
-            return list_users
-        except Exception as e:
-            logger.error(f"Ошибка при получении всех пользователей: {e}")
-            return []
-        finally:
-            session.close()
+    def get_all_users(self) -> list[int]:
+        """Получает id всех пользователей"""
+        with self.db.ReadSession() as session:
+            try:
+                # Материализуем только id, без построения ORM-объектов
+                return session.execute(_GET_USER_IDS_STMT).scalars().all()
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении всех пользователей: {e}")
+                return []
 
     def save_token(self, user_id: int, token_data: dict) -> bool:
         """Сохраняет токен для пользователя"""
-        session = self.db.get_session()
-        try:
-            # Проверяем, существует ли уже токен для этого пользователя
-            ready_token = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id, Token.email == token_data.get('email'), Token.status == "ready").first()
-            auth_token = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id, Token.status == "auth").first()
-            if ready_token:
-                # Обновляем существующий токен
-                session.delete(session.query(UserTokenLink).filter(UserTokenLink.user_id == user_id, UserTokenLink.token_id == auth_token.id).first())
-                session.delete(auth_token)
-                session.commit()
-                return False, "❌ Данный email уже используется"
-            else:
+        with self.db.Session() as session:
+            try:
+                # Одним запросом получаем токен в процессе авторизации и готовый токен с тем же email
+                tokens = (
+                    session.query(Token)
+                    .join(UserTokenLink)
+                    .filter(
+                        UserTokenLink.user_id == user_id,
+                        or_(
+                            Token.status == "auth",
+                            and_(
+                                Token.status == "ready",
+                                Token.email == token_data.get('email'),
+                            ),
+                        ),
+                    )
+                    .all()
+                )
+                auth_token = next((t for t in tokens if t.status == "auth"), None)
+                ready_token = next((t for t in tokens if t.status == "ready"), None)
+                if ready_token:
+                    # Email уже привязан, удаляем незавершенную авторизацию
+                    if auth_token:
+                        # Удаляем одним набором DELETE, не загружая каскадные связи через ORM
+                        self._delete_tokens(session, [auth_token.id])
+                    session.commit()
+                    return False, "❌ Данный email уже используется"
                 if auth_token:
                     # Обновляем существующий токен
-                    auth_token.token_data = json.dumps(token_data)
+                    auth_token.token_data = token_data
                     auth_token.email = token_data.get('email')
                     auth_token.status = "ready"
                     session.commit()
-                    logger.info(f"Токен сохранен для пользователя: {user_id}")
+                    logger.info("Токен сохранен для пользователя: %s", user_id)
                     return True, "Токен сохранен"
                 session.commit()
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при сохранении токена: {e}")
-            return False, f"Ошибка при сохранении токена: {e}"
-        finally:
-            session.close()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка при сохранении токена: {e}")
+                return False, f"Ошибка при сохранении токена: {e}"
+            finally:
+                self._invalidate_token_cache(user_id)
+
+    def get_token_bundle(self, user_id: int, status: str | None = None) -> Any:
+        """Получает поля токена пользователя одним запросом без загрузки ORM-объекта"""
+        key = (user_id, status or None)
+        cached = self._bundle_cache.get(key)
+        if cached is not MISSING:
+            return cached
+        with self.db.ReadSession() as session:
+            try:
+                if status:
+                    bundle = session.execute(
+                        _GET_TOKEN_BUNDLE_BY_STATUS_STMT,
+                        {"user_id": user_id, "status": status},
+                    ).first()
+                else:
+                    bundle = session.execute(
+                        _GET_TOKEN_BUNDLE_STMT, {"user_id": user_id}
+                    ).first()
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении токена: {e}")
+                return None
+        # Кэшируем и отсутствие токена, чтобы не опрашивать БД повторно
+        self._bundle_cache.set(key, bundle)
+        return bundle
 
     def get_token(self, user_id: int) -> Any:
         """Получает токен пользователя"""
-        session = self.db.get_session()
-        try:
-            token = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id).first()
-            if token:
-                logger.info(f"Успешно получен токен: {token}")
-                return json.loads(token.token_data)
-            logger.info(f"Токен не найден для пользователя: {user_id}")
+        token = self.get_token_bundle(user_id)
+        if not token:
+            logger.info("Токен не найден для пользователя: %s", user_id)
             return None
-        except Exception as e:
-            logger.error(f"Ошибка при получении токена: {e}")
-            return None
-        finally:
-            session.close()
+        return token.token_data
     
     def get_all_tokens_by_user_id(self, user_id: int) -> Any:
         """Получает все токены для пользователя"""
-        session = self.db.get_session()
-        try:
-            tokens = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id).all()
-            return tokens
-        except Exception as e:
-            logger.error(f"Ошибка при получении всех токенов для пользователя: {e}")
-            return []
-        finally:
-            session.close()
+        with self.db.ReadSession() as session:
+            try:
+                return (
+                    session.execute(_GET_USER_TOKENS_STMT, {"user_id": user_id})
+                    .scalars()
+                    .all()
+                )
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении всех токенов для пользователя: {e}")
+                return []
             
 
     def get_auth_state(self, user_id: int) -> tuple[dict | None, str | None]:
         """Получение состояния авторизации"""
-        session = self.db.get_session()
-        try:
-            token = session.query(Token).join(UserTokenLink).filter(
-                UserTokenLink.user_id == user_id, 
-                Token.status == "auth"
-            ).first()
-            
-            if token:
-                logger.info(f"Успешно получен токен: {token}")
-                return json.loads(token.token_data), token.redirect_url
-            logger.info(f"Токен не найден для пользователя: {user_id}")
+        token = self.get_token_bundle(user_id, status="auth")
+        if not token:
+            logger.info("Токен не найден для пользователя: %s", user_id)
             return None, None
-        except Exception as e:
-            logger.error(f"Ошибка при получении состояния авторизации: {e}")
-            return None, None
-        finally:
-            session.close()
+        return token.token_data, token.redirect_url
+
+    @staticmethod
+    def _delete_tokens(session: Session, token_ids: list[int]) -> None:
+        """Удаляет токены с их событиями, уведомлениями и связками одним проходом DELETE"""
+        session.execute(
+            delete(Notification).where(Notification.token_id.in_(token_ids))
+        )
+        session.execute(delete(Event).where(Event.token_id.in_(token_ids)))
+        session.execute(
+            delete(UserTokenLink).where(UserTokenLink.token_id.in_(token_ids))
+        )
+        session.execute(delete(Token).where(Token.id.in_(token_ids)))
 
-    def delete_token_by_email(self, user_id: int, email: str) -> bool:
-        """Удаляет токен для пользователя"""
-        session = self.db.get_session()
+    def delete_token_by_email(self, user_id: int, email: str) -> list[int]:
+        """Удаляет токен для пользователя, возвращает id удаленных токенов"""
         try:
-            token = session.query(Token).join(UserTokenLink).filter(Token.email == email, UserTokenLink.user_id == user_id).first()
-            if token:
-                session.delete(session.query(UserTokenLink).filter(UserTokenLink.token_id == token.id).first())
-                session.delete(token)
-                session.commit()
-                logger.info(f"Токен удален для пользователя: {email} и {user_id}")
-                return True
-            else:
-                logger.info(f"Токен не найден для пользователя: {email} и {user_id}")
-                return False
-        except Exception as e:
-            session.rollback()
+            with self.db.session_scope() as session:
+                token_ids = (
+                    session.execute(
+                        select(Token.id)
+                        .join(UserTokenLink, UserTokenLink.token_id == Token.id)
+                        .where(Token.email == email, UserTokenLink.user_id == user_id)
+                    )
+                    .scalars()
+                    .all()
+                )
+                if token_ids:
+                    self._delete_tokens(session, token_ids)
+        except SQLAlchemyError as e:
             logger.error(f"Ошибка при удалении токена: {e}")
-            return False
-        finally:
-            session.close()
+            return []
+        if not token_ids:
+            logger.info("Токен не найден для пользователя: %s и %s", email, user_id)
+            return []
+        self._invalidate_token_cache(user_id)
+        logger.info("Токен удален для пользователя: %s и %s", email, user_id)
+        return list(token_ids)
 
     def save_auth_state(
         self, user_id: int, flow_state: dict, redirect_uri: str, status_auth: str
     ) -> bool:
         """Сохранение состояния авторизации"""
-        session = self.db.get_session()
-        try:
-            # Проверяем, существует ли уже токен для этого пользователя
-            tokens = session.query(UserTokenLink).filter(UserTokenLink.user_id == user_id).all()
-            not_auth_tokens = session.query(Token).filter(Token.status == status_auth).all()
-            logger.info(f"\nnot_auth_tokens: {not_auth_tokens}")
-            if not session.query(User).filter(User.id == user_id).first():
-                return False, "❌ Нажмите /start и попробуйте снова."
-            for token in not_auth_tokens:
-                # Находим связку для текущего токена
-                token_link = session.query(UserTokenLink).filter(
-                    UserTokenLink.token_id == token.id
-                ).first()
-                
-                # Если связка существует, удаляем её
-                if token_link:
-                    session.delete(token_link)
-                
-                # Удаляем сам токен
-                session.delete(token)
-                session.commit()
-            if len(tokens) >= 5:
-                # Обновляем существующий токен с данными состояния авторизации
-                return False, "❌ Вы исчерпали лимит на количество авторизаций(5)."
-            else:
+        with self.db.Session() as session:
+            try:
+                if session.get(User, user_id) is None:
+                    return False, "❌ Нажмите /start и попробуйте снова."
+                # Удаляем незавершенные авторизации пользователя
+                stale_token_ids = [
+                    token_id
+                    for (token_id,) in session.query(Token.id)
+                    .join(UserTokenLink)
+                    .filter(UserTokenLink.user_id == user_id, Token.status == status_auth)
+                    .all()
+                ]
+                if stale_token_ids:
+                    session.query(UserTokenLink).filter(
+                        UserTokenLink.token_id.in_(stale_token_ids)
+                    ).delete(synchronize_session=False)
+                    session.query(Token).filter(Token.id.in_(stale_token_ids)).delete(
+                        synchronize_session=False
+                    )
+                tokens_count = (
+                    session.query(UserTokenLink)
+                    .filter(UserTokenLink.user_id == user_id)
+                    .count()
+                )
+                if tokens_count >= 5:
+                    session.commit()
+                    return False, "❌ Вы исчерпали лимит на количество авторизаций(5)."
                 # Создаем новый токен с данными состояния авторизации
                 token = Token(
-                    token_data=json.dumps(flow_state),
+                    token_data=flow_state,
                     redirect_url=redirect_uri,
                     status=status_auth
                 )
                 session.add(token)
-            filter_user_token_link = session.query(UserTokenLink).filter(UserTokenLink.user_id == user_id, UserTokenLink.token_id == token.id).first()
-            if not filter_user_token_link:
-                user_token_link = UserTokenLink(user_id=user_id, token_id=token.id)
-                session.add(user_token_link)
-            session.commit()
-            logger.info(f"Состояние авторизации сохранено для пользователя: {user_id}")
-            return True, "Состояние авторизации сохранено"
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при сохранении состояния авторизации: {e}")
-            return False, f"Ошибка при сохранении состояния авторизации: {e}"
-        finally:
-            session.close()
+                session.flush()
+                session.add(UserTokenLink(user_id=user_id, token_id=token.id))
+                session.commit()
+                logger.info(
+                    "Состояние авторизации сохранено для пользователя: %s", user_id
+                )
+                return True, "Состояние авторизации сохранено"
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка при сохранении состояния авторизации: {e}")
+                return False, f"Ошибка при сохранении состояния авторизации: {e}"
+            finally:
+                self._invalidate_token_cache(user_id)
 
     def set_auth_message_id(self, user_id: int, auth_message_id: str) -> bool:
         """Устанавливает ID сообщения авторизации"""
-        session = self.db.get_session()
         try:
-            token = session.query(Token).join(UserTokenLink).filter(
-                UserTokenLink.user_id == user_id, 
-                Token.status == "auth"
-            ).first()
-            if token:
-                token.auth_message_id = str(auth_message_id)
-            else:
-                logger.warning(f"Токен не найден для пользователя {user_id}")
-                return False
-            session.commit()
-            logger.info(
-                f"ID сообщения авторизации установлен для пользователя: {user_id}"
-            )
-            return True
-        except Exception as e:
-            session.rollback()
+            with self.db.session_scope() as session:
+                # Обновляем токен одним UPDATE по первичному ключу без загрузки объекта
+                result = session.execute(
+                    _SET_AUTH_MESSAGE_ID_STMT,
+                    {"user_id": user_id, "auth_message_id": str(auth_message_id)},
+                )
+        except SQLAlchemyError as e:
             logger.error(f"Ошибка при установке ID сообщения авторизации: {e}")
             return False
-        finally:
-            session.close()
+        if not result.rowcount:
+            logger.warning("Токен не найден для пользователя %s", user_id)
+            return False
+        self._invalidate_token_cache(user_id)
+        logger.info("ID сообщения авторизации установлен для пользователя: %s", user_id)
+        return True
 
     def get_auth_message_id(self, user_id: int) -> int | None:
         """Получает ID сообщения авторизации"""
-        session = self.db.get_session()
-        try:
-            token = session.query(Token).join(UserTokenLink).filter(UserTokenLink.user_id == user_id, Token.status == "auth").first()
-            if not token:
-                logger.info(f"Токены не найдены для пользователя: {user_id}")
-                return None
-            logger.info(f"Успешно получен токен: {token}")
-            return token.auth_message_id
-        except Exception as e:
-            logger.error(f"Ошибка при получении ID сообщения авторизации: {e}")
+        token = self.get_token_bundle(user_id, status="auth")
+        if not token:
+            logger.info("Токены не найдены для пользователя: %s", user_id)
             return None
-        finally:
-            session.close()
+        return token.auth_message_id
 
 
 class EventQueries(Queries):
@@ -373,61 +545,69 @@ class EventQueries(Queries):
 
     def reset_processed_events(self, user_id: int) -> None:
         """Сбрасывает все данные в базе"""
-        session = self.db.get_session()
         try:
-            session.query(Event).filter(Event.user_id == user_id).delete()
-            session.commit()
-        except Exception as e:
+            with self.db.session_scope() as session:
+                # У событий нет user_id, поэтому удаляем по токенам пользователя
+                session.execute(
+                    delete(Event)
+                    .where(Event.token_id.in_(_USER_TOKEN_IDS_STMT))
+                    .execution_options(synchronize_session=False),
+                    {"user_id": user_id},
+                )
+        except SQLAlchemyError as e:
             logger.error(f"Ошибка при сбросе данных: {e}")
-        finally:
-            session.close()
 
-    def get_statistics(self, user_id: int, period: str) -> str:
-        """Получает статистику по встречам"""
-        session = self.db.get_session()
-        try:
-            # Получаем текущую дату
-            now = datetime.now(timezone.utc)
-
-            # Устанавливаем начало и конец периода в зависимости от выбранного периода
-            if period == "week":
-                # Получаем начало текущей недели (понедельник)
-                start_date = now - timedelta(days=now.weekday())
-                start_date = start_date.replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                end_date = now
-            elif period == "month":
-                # Получаем первый день текущего месяца
-                start_date = now.replace(
-                    day=1, hour=0, minute=0, second=0, microsecond=0
-                )
-                end_date = now
-            else:  # year
-                # Получаем первый день текущего года
-                start_date = now.replace(
-                    month=1, day=1, hour=0, minute=0, second=0, microsecond=0
-                )
-                end_date = now
+    @staticmethod
+    def _statistics_period(period: str) -> tuple[datetime, datetime]:
+        """Возвращает границы периода статистики в naive UTC"""
+        # Получаем текущую дату
+        now = datetime.now(timezone.utc)
 
-            end_date = end_date.replace(hour=23, minute=59, second=59)
+        # Устанавливаем начало и конец периода в зависимости от выбранного периода
+        if period == "week":
+            # Получаем начало текущей недели (понедельник)
+            start_date = now - timedelta(days=now.weekday())
+            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        elif period == "month":
+            # Получаем первый день текущего месяца
+            start_date = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        else:  # year
+            # Получаем первый день текущего года
+            start_date = now.replace(
+                month=1, day=1, hour=0, minute=0, second=0, microsecond=0
+            )
+        end_date = now.replace(hour=23, minute=59, second=59)
+        return to_naive_utc(start_date), to_naive_utc(end_date)
 
-            # Получаем все события за выбранный период
-            events = (
-                session.query(Event)
-                .filter(
-                    Event.user_id == user_id,
-                    Event.start_time >= start_date,
-                    Event.start_time <= end_date,
-                )
-                .all()
+    def _statistics_filter(self, user_id: int, period: str) -> tuple:
+        """Условия выборки событий пользователя за период статистики"""
+        start_date, end_date = self._statistics_period(period)
+        return (
+            Event.token_id.in_(_USER_TOKEN_IDS_STMT.params(user_id=user_id)),
+            Event.start_time >= start_date,
+            Event.start_time <= end_date,
+        )
+
+    def get_statistics_aggregated(self, user_id: int, period: str) -> tuple[int, float]:
+        """Считает в БД количество встреч и их общую длительность в минутах"""
+        # Разница дат считается средствами конкретной СУБД
+        if self.db.engine.dialect.name == "postgresql":
+            duration = func.extract("epoch", Event.end_time - Event.start_time)
+        else:
+            duration = func.strftime("%s", Event.end_time) - func.strftime(
+                "%s", Event.start_time
             )
-            return events
-        except Exception as e:
-            logger.error(f"Ошибка при получении статистики: {e}")
-            return []
-        finally:
-            session.close()
+        with self.db.ReadSession() as session:
+            try:
+                count, total_seconds = session.execute(
+                    select(func.count(), func.coalesce(func.sum(duration), 0)).where(
+                        *self._statistics_filter(user_id, period)
+                    )
+                ).one()
+                return count, float(total_seconds) / 60
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении статистики: {e}")
+                return 0, 0.0
 
     def check_deleted_events(
         self,
@@ -435,343 +615,483 @@ class EventQueries(Queries):
         active_events: list[dict],
         time_min: datetime,
         time_max: datetime,
-    ) -> None:
+    ) -> list[dict]:
         """Проверяет, было ли удалено какое либо событие из календаря за указанный период"""
-        session = self.db.get_session()
-        deleted_events = []
-        try:
-            # Получаем все события из БД за указанный период
-            tokens = session.query(UserTokenLink).filter(UserTokenLink.user_id == user_id).all()
-            token_ids = [token.token_id for token in tokens]
-            all_events_db = (
-                session.query(Event)
-                .filter(
-                    Event.token_id.in_(token_ids),
-                    Event.start_time >= time_min,
-                    Event.start_time <= time_max,
+        # Пустой список активных событий не считаем удалением всех встреч
+        if not active_events:
+            return []
+        active_ids = {event["id"] for event in active_events}
+        with self.db.Session() as session:
+            deleted_events = []
+            try:
+                # Получаем все события из БД за указанный период
+                token_ids = select(UserTokenLink.token_id).where(
+                    UserTokenLink.user_id == user_id
                 )
-                .all()
-            )
-            time_zones = [event["start"]["timeZone"] for event in active_events]
-            current_time_now = datetime.now()
-            current_time_timezone = current_time_now.astimezone(
-                pytz.timezone(time_zones[0])
-            )
-            for event in all_events_db:
-                # Пропускаем уже завершившиеся события
-                # Добавляем часовой пояс к event.end_time, если его нет
-                event_end_time = event.end_time
-                if event_end_time.tzinfo is None:
-                    event_end_time = event_end_time.replace(tzinfo=timezone.utc)
-                # Всегда сравниваем в UTC
-                if event_end_time <= current_time_timezone:
-                    logger.info(f"Событие {event.event_id} завершено")
-                    continue
-                # Проверяем было ли событие удалено из активных
-                if event.event_id not in [event["id"] for event in active_events]:
-                    deleted_events.append(
-                        {
-                            "id": event.event_id,
-                            "summary": event.title,
-                            "start": event.start_time,
-                            "end": event.end_time,
-                            "token_email": event.token.email,
-                        }
+                all_events_db = (
+                    session.query(Event)
+                    .options(joinedload(Event.token).load_only(Token.id, Token.email))
+                    .filter(
+                        Event.token_id.in_(token_ids),
+                        Event.start_time >= time_min,
+                        Event.start_time <= time_max,
                     )
-                    session.query(Notification).filter(
-                        Notification.event_id == event.event_id
-                    ).delete()
-                    session.delete(event)
-            session.commit()
-            return deleted_events
-        except Exception as e:
-            logger.error(f"Ошибка при проверке удаленных событий: {e}")
-            return []
-        finally:
-            session.close()
+                    .all()
+                )
+                # Время событий хранится в naive UTC, поэтому строки сравниваются без приведения
+                current_time = to_naive_utc(datetime.now(timezone.utc))
+                to_delete_ids = []
+                for event_db in all_events_db:
+                    # Пропускаем уже завершившиеся события
+                    if event_db.end_time <= current_time:
+                        logger.debug("Событие %s завершено", event_db.event_id)
+                        continue
+                    # Проверяем было ли событие удалено из активных
+                    if event_db.event_id not in active_ids:
+                        # В сообщении время показывается в поясе события,
+                        # как и у обновленных встреч
+                        stored_start = (event_db.all_data or {}).get("start") or {}
+                        event_tz = stored_start.get("timeZone") or "UTC"
+                        deleted_events.append(
+                            {
+                                "id": event_db.event_id,
+                                "summary": event_db.title,
+                                "start": from_naive_utc(event_db.start_time, event_tz),
+                                "end": from_naive_utc(event_db.end_time, event_tz),
+                                "token_email": event_db.token.email,
+                            }
+                        )
+                        to_delete_ids.append(event_db.id)
+                if to_delete_ids:
+                    # Удаляем уведомления и события двумя запросами вместо пары на событие
+                    session.execute(
+                        delete(Notification)
+                        .where(Notification.event_id.in_(to_delete_ids))
+                        .execution_options(synchronize_session=False)
+                    )
+                    session.execute(
+                        delete(Event)
+                        .where(Event.id.in_(to_delete_ids))
+                        .execution_options(synchronize_session=False)
+                    )
+                session.commit()
+                return deleted_events
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка при проверке удаленных событий: {e}")
+                return []
 
     def check_updated_event(self, user_id: int, active_events: list[dict]) -> list:
         """Получает обновленные события"""
-        session = self.db.get_session()
-        try:
-            updated_events = []
-
-            for event in active_events:
-                event_db = session.query(Event).filter_by(event_id=event["id"]).first()
-
-                # Проверяем, что event_db не None
-                if not event_db:
-                    logger.info(
-                        f"Событие {event['id']} не найдено в базе данных, пропускаем"
+        with self.db.Session() as session:
+            try:
+                updated_events = []
+                # Сначала сверяем только хэши, полные строки читаем лишь для изменившихся
+                new_hashes = {
+                    event["id"]: event_content_hash(event) for event in active_events
+                }
+                stored_hashes = {}
+                if new_hashes:
+                    stored_hashes = dict(
+                        session.execute(
+                            select(Event.event_id, Event.content_hash).where(
+                                Event.event_id.in_(new_hashes)
+                            )
+                        ).all()
                     )
-                    continue
+                event_ids = {
+                    event_id
+                    for event_id, content_hash in stored_hashes.items()
+                    if content_hash != new_hashes[event_id]
+                }
+                events_by_id = {}
+                if event_ids:
+                    events_by_id = {
+                        event_db.event_id: event_db
+                        for event_db in session.query(Event)
+                        .options(
+                            load_only(
+                                Event.id,
+                                Event.event_id,
+                                Event.title,
+                                Event.meet_link,
+                                Event.all_data,
+                                Event.content_hash,
+                            ),
+                            joinedload(Event.token).load_only(Token.id, Token.email),
+                        )
+                        .filter(Event.event_id.in_(event_ids))
+                    }
 
-                # Получаем строки дат из события
-                start_time = datetime.fromisoformat(
-                    event.get("start", {}).get(
-                        "dateTime", event.get("start", {}).get("date")
-                    )
-                )
-                end_time = datetime.fromisoformat(
-                    event.get("end", {}).get(
-                        "dateTime", event.get("end", {}).get("date")
-                    )
-                )
+                missing_hashes = []
+                changed_rows = []
+                for event in active_events:
+                    if event["id"] not in stored_hashes:
+                        logger.debug(
+                            "Событие %s не найдено в базе данных, пропускаем",
+                            event["id"],
+                        )
+                        continue
+                    event_db = events_by_id.get(event["id"])
+                    # Хэш совпал: событие не менялось, разбирать даты не нужно
+                    if not event_db:
+                        continue
+                    stored_data = event_db.all_data or {}
+                    if event_db.content_hash is None:
+                        # Строки, сохраненные до появления хэша, досчитываем по all_data
+                        db_hash = event_content_hash(stored_data)
+                        if db_hash == new_hashes[event["id"]]:
+                            missing_hashes.append(
+                                {"b_id": event_db.id, "b_hash": db_hash}
+                            )
+                            continue
 
-                # Добавляем часовой пояс к event_db.start_time и event_db.end_time, если его нет
-                db_start_time = safe_parse_datetime(
-                    event_db.all_data.get("start", {}).get(
-                        "dateTime", event_db.all_data.get("start", {}).get("date")
-                    ),
-                    event_db.all_data.get("start", {}).get("timeZone"),
-                )
-                db_end_time = safe_parse_datetime(
-                    event_db.all_data.get("end", {}).get(
-                        "dateTime", event_db.all_data.get("end", {}).get("date")
-                    ),
-                    event_db.all_data.get("end", {}).get("timeZone"),
-                )
-                # Проверяем, изменились ли данные
-                if (
-                    event_db.title != event["summary"]
-                    or event_db.meet_link != event.get("hangoutLink", "")
-                    or abs((db_start_time - start_time).total_seconds()) > 60
-                    or abs((db_end_time - end_time).total_seconds()) > 60
-                ):
-
-                    old_title = event_db.title
-                    old_start = db_start_time
-                    old_end = db_end_time
-                    old_meet_link = event_db.meet_link
-
-                    # Обновляем данные события
-                    event_db.title = event["summary"]
-                    event_db.start_time = start_time
-                    event_db.end_time = end_time
-                    event_db.meet_link = event.get("hangoutLink", "")
-                    event_db.all_data = event
-
-                    # Добавляем в список обновленных событий
-                    updated_events.append(
+                    # Все даты разбираются один раз и с часовым поясом, разбор кэшируется
+                    start_time = parse_event_time(event, "start")
+                    end_time = parse_event_time(event, "end")
+                    db_start_time = parse_event_time(stored_data, "start")
+                    db_end_time = parse_event_time(stored_data, "end")
+                    # Хэш изменился: строку переписываем, даже если уведомлять не о чем,
+                    # иначе событие будет перечитываться при каждом опросе.
+                    # Изменения копятся и пишутся одним executemany после цикла
+                    changed_rows.append(
                         {
-                            "id": event_db.event_id,
-                            "summary": event_db.title,
-                            "old_summary": old_title,
-                            "start": start_time,
-                            "old_start": old_start,
-                            "end": end_time,
-                            "old_end": old_end,
-                            "old_meet_link": old_meet_link,
-                            "token_email": event_db.token.email,
+                            "b_id": event_db.id,
+                            "b_title": event["summary"],
+                            "b_start_time": to_naive_utc(start_time),
+                            "b_end_time": to_naive_utc(end_time),
+                            "b_meet_link": event.get("hangoutLink", ""),
+                            "b_all_data": event,
+                            "b_content_hash": new_hashes[event["id"]],
                         }
                     )
+                    # Проверяем, изменились ли данные
+                    if (
+                        event_db.title != event["summary"]
+                        or event_db.meet_link != event.get("hangoutLink", "")
+                        or abs((db_start_time - start_time).total_seconds()) > 60
+                        or abs((db_end_time - end_time).total_seconds()) > 60
+                    ):
 
-            session.commit()
-            logger.info(f"Обновленные события: {len(updated_events)}")
-            return updated_events
-        except Exception as e:
-            logger.error(f"Ошибка при получении обновленных событий: {e}")
-            session.rollback()
-            return []
-        finally:
-            session.close()
+                        old_title = event_db.title
+                        old_start = db_start_time
+                        old_end = db_end_time
+                        old_meet_link = event_db.meet_link
+
+                        # Добавляем в список обновленных событий
+                        updated_events.append(
+                            {
+                                "id": event_db.event_id,
+                                "summary": event["summary"],
+                                "old_summary": old_title,
+                                "start": start_time,
+                                "old_start": old_start,
+                                "end": end_time,
+                                "old_end": old_end,
+                                "old_meet_link": old_meet_link,
+                                "token_email": event_db.token.email,
+                            }
+                        )
+
+                if changed_rows:
+                    session.execute(_UPDATE_EVENT_STMT, changed_rows)
+                if missing_hashes:
+                    session.execute(_SET_EVENT_HASH_STMT, missing_hashes)
+                session.commit()
+                logger.info("Обновленные события: %d", len(updated_events))
+                return updated_events
+            except Exception as e:
+                logger.error(f"Ошибка при получении обновленных событий: {e}")
+                session.rollback()
+                return []
 
     def save_event(self, user_id: int, event_data: dict) -> bool:
         """Сохраняет событие в базу данных"""
-        session = self.db.get_session()
-        try:
-            # Проверяем существует ли событие
-            event_id = event_data.get("id")
-            if not event_id:
-                logger.error(f"Отсутствует ID события в данных: {event_data}")
-                return False
-            
-            existing_event = session.query(Event).filter(Event.id == event_id).first()
-            
-            if existing_event:
-                # Обновляем существующее событие
-                existing_event.title = event_data.get("summary", "Без названия")
-                existing_event.start_time = safe_parse_datetime(
-                    event_data["start"].get("dateTime"), event_data["start"].get("timeZone")
-                )
-                existing_event.end_time = safe_parse_datetime(
-                    event_data["end"].get("dateTime"), event_data["end"].get("timeZone")
-                )
-                existing_event.meet_link = event_data.get("hangoutLink")
-                existing_event.all_data = event_data
-                existing_event.updated_at = datetime.now(timezone.utc)
+        if not event_data.get("id"):
+            logger.error(f"Отсутствует ID события в данных: {event_data}")
+            return False
+        return self.save_events_bulk(user_id, [event_data])
+
+    def save_events_bulk(self, user_id: int, events: list[dict]) -> bool:
+        """Сохраняет пачку событий одним запросом INSERT ... ON CONFLICT DO UPDATE"""
+        if not events:
+            return True
+        with self.db.Session() as session:
+            try:
+                # token_id проставляет клиент календаря, email нужен только как запасной вариант
+                emails = {
+                    event_data.get("token_email")
+                    for event_data in events
+                    if not event_data.get("token_id")
+                }
+                token_ids = {}
+                if emails:
+                    token_ids = dict(
+                        session.query(Token.email, Token.id)
+                        .join(UserTokenLink)
+                        .filter(UserTokenLink.user_id == user_id, Token.email.in_(emails))
+                        .all()
+                    )
+
+                now = datetime.now(timezone.utc)
+                rows = {}
+                for event_data in events:
+                    event_id = event_data.get("id")
+                    token_id = event_data.get("token_id") or token_ids.get(
+                        event_data.get("token_email")
+                    )
+                    if not event_id or not token_id:
+                        logger.error("Не удалось сохранить событие: %s", event_id)
+                        continue
+                    # Одно событие может прийти из нескольких аккаунтов, в пачке оно должно быть одно
+                    rows[event_id] = {
+                        "id": event_id,
+                        "event_id": event_id,
+                        "title": event_data.get("summary", "Без названия"),
+                        "start_time": to_naive_utc(parse_event_time(event_data, "start")),
+                        "end_time": to_naive_utc(parse_event_time(event_data, "end")),
+                        "meet_link": event_data.get("hangoutLink"),
+                        "token_id": token_id,
+                        "all_data": event_data,
+                        "content_hash": event_content_hash(event_data),
+                        "created_at": now,
+                        "updated_at": now,
+                    }
+                if not rows:
+                    return False
+
+                values = list(rows.values())
+                # Все пачки пишутся в одной транзакции с одним commit
+                for start in range(0, len(values), BULK_CHUNK_SIZE):
+                    stmt = self.db.insert(Event).values(
+                        values[start : start + BULK_CHUNK_SIZE]
+                    )
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[Event.id],
+                        set_={
+                            "title": stmt.excluded.title,
+                            "start_time": stmt.excluded.start_time,
+                            "end_time": stmt.excluded.end_time,
+                            "meet_link": stmt.excluded.meet_link,
+                            "all_data": stmt.excluded.all_data,
+                            "content_hash": stmt.excluded.content_hash,
+                            "updated_at": stmt.excluded.updated_at,
+                        },
+                    )
+                    session.execute(stmt)
                 session.commit()
-                logger.info(f"Обновлено событие: {existing_event.title}")
+                logger.info("Сохранено событий: %d для пользователя: %s", len(rows), user_id)
                 return True
-            
-            # Создаем новое событие
-            token = session.query(Token).filter(Token.email == event_data.get("token_email")).first()
-            if not token:
-                logger.error(f"Токен не найден для события: {event_data}")
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Ошибка при сохранении событий: {e}")
                 return False
-            event = Event(
-                id=event_id,  # Устанавливаем id равным event_id из Google Calendar
-                event_id=event_id,
-                title=event_data.get("summary", "Без названия"),
-                start_time=safe_parse_datetime(
-                    event_data["start"].get("dateTime"), event_data["start"].get("timeZone")
-                ),
-                end_time=safe_parse_datetime(
-                    event_data["end"].get("dateTime"), event_data["end"].get("timeZone")
-                ),
-                meet_link=event_data.get("hangoutLink"),
-                token_id=token.id,
-                all_data=event_data,
+
+    @staticmethod
+    def _user_events_query(
+        session: Session,
+        user_id: int,
+        start_time: datetime | None = None,
+        end_time: datetime | None = None,
+        limit: int | None = None,
+        columns: tuple | None = None,
+    ) -> Any:
+        """Строит запрос событий пользователя с фильтрацией по времени"""
+        # Выбираем только нужные колонки, если они переданы
+        if columns:
+            query = session.query(*columns)
+        else:
+            # Объекты возвращаются после закрытия сессии, поэтому все, что
+            # читают вызывающие (включая email токена), загружается сразу
+            query = session.query(Event).options(
+                load_only(*EVENT_LOAD_COLUMNS),
+                joinedload(Event.token).load_only(Token.id, Token.email),
             )
-            session.add(event)
-            session.commit()
-            logger.info(f"Сохранено новое событие: {event.title}")
-            return True
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при сохранении события: {e}")
-            return False
-        finally:
-            session.close()
+        query = query.select_from(Event).join(
+            UserTokenLink, UserTokenLink.token_id == Event.token_id
+        ).filter(UserTokenLink.user_id == user_id)
+
+        if start_time:
+            query = query.filter(Event.end_time >= start_time)
+        if end_time:
+            query = query.filter(Event.start_time <= end_time)
+
+        query = query.order_by(Event.start_time)
+        if limit:
+            query = query.limit(limit)
+        return query
 
     def get_user_events(
         self,
         user_id: int,
         start_time: datetime | None = None,
         end_time: datetime | None = None,
+        limit: int | None = None,
+        columns: tuple | None = None,
     ) -> Any:
         """Получает события пользователя с возможностью фильтрации по времени"""
-        session = self.db.get_session()
-        try:
-            query = session.query(Event).filter(Event.user_id == user_id)
-
-            if start_time:
-                query = query.filter(Event.end_time >= start_time)
-            if end_time:
-                query = query.filter(Event.start_time <= end_time)
-
-            events = query.order_by(Event.start_time).all()
-            logger.info(f"Успешно получены события: {events}")
-            return events
-        except Exception as e:
-            logger.error(f"Ошибка при получении событий: {e}")
-            return []
-        finally:
-            session.close()
+        with self.db.ReadSession() as session:
+            try:
+                events = self._user_events_query(
+                    session, user_id, start_time, end_time, limit, columns
+                ).all()
+                logger.info(
+                    "Получено событий: %d для пользователя: %s", len(events), user_id
+                )
+                return events
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении событий: {e}")
+                return []
 
 
+    def iter_user_events(
+        self,
+        user_id: int,
+        start_time: datetime | None = None,
+        end_time: datetime | None = None,
+    ) -> Iterator[Any]:
+        """Постранично отдает события пользователя только с колонками для вывода"""
+        # Отдельная транзакционная сессия: курсор stream_results живет в транзакции,
+        # AUTOCOMMIT-сессия для чтения его не поддерживает
+        with self.db.new_session() as session:
+            try:
+                query = self._user_events_query(
+                    session, user_id, start_time, end_time, columns=EVENT_ROW_COLUMNS
+                )
+                yield from query.execution_options(stream_results=True).yield_per(200)
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении событий: {e}")
+
 class NotificationQueries(Queries):
     def reset_notifications(self, user_id: int) -> None:
         """Сбрасывает все данные в базе"""
-        session = self.db.get_session()
         try:
-            session.query(Notification).filter(Notification.user_id == user_id).delete()
-            session.commit()
-        except Exception as e:
+            with self.db.session_scope() as session:
+                # У уведомлений нет user_id, поэтому удаляем по токенам пользователя
+                session.execute(
+                    delete(Notification)
+                    .where(Notification.token_id.in_(_USER_TOKEN_IDS_STMT))
+                    .execution_options(synchronize_session=False),
+                    {"user_id": user_id},
+                )
+        except SQLAlchemyError as e:
             logger.error(f"Ошибка при сбросе данных: {e}")
-        finally:
-            session.close()
 
     # Методы для работы с уведомлениями
-    def create_notification(self, event_id: str) -> Notification | None:
-        """Создает новое уведомление"""
-        session = self.db.get_session()
+    def create_notifications(self, event_ids: list[str]) -> bool:
+        """Создает уведомления для пачки событий одним INSERT ... SELECT"""
+        event_ids = list(dict.fromkeys(event_ids))
+        if not event_ids:
+            return True
+        # token_id берется из событий прямо в INSERT ... SELECT, дубликаты отсекает индекс
+        stmt = (
+            self.db.insert(Notification)
+            .from_select(
+                ["event_id", "token_id", "sent_at", "is_sent"],
+                select(
+                    Event.event_id,
+                    Event.token_id,
+                    literal(datetime.now(timezone.utc), DateTime),
+                    literal(True),
+                ).where(Event.event_id.in_(event_ids)),
+            )
+            .on_conflict_do_nothing(
+                index_elements=[Notification.event_id, Notification.token_id]
+            )
+        )
         try:
-            # Проверяем существует ли уже уведомление для этого события
-            event = session.query(Event).filter(Event.event_id == event_id).first()
-            existing = (
-                session.query(Notification)
-                .filter(
-                    Notification.event_id == event_id, Notification.token_id == event.token_id
-                )
-                .first()
+            with self.db.session_scope() as session:
+                result = session.execute(stmt)
+            logger.info(
+                "Создано уведомлений: %d из %d событий", result.rowcount, len(event_ids)
             )
+            return True
+        except SQLAlchemyError as e:
+            logger.error(f"Ошибка при создании уведомлений: {e}")
+            return False
 
-            if existing:
-                logger.info(f"Уведомление для события {event_id} уже существует")
-                return existing
-
-            notification = Notification(event_id=event_id, token_id=event.token_id)
-            session.add(notification)
-            session.commit()
-            logger.info(f"Уведомление создано: {notification}")
-            return notification
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Ошибка при создании уведомления: {e}")
-            return None
-        finally:
-            session.close()
+    def create_notification(self, event_id: str) -> bool:
+        """Создает уведомление для события, если его еще нет"""
+        return self.create_notifications([event_id])
 
     def get_notification(self, event_id: str, user_id: int) -> Notification | None:
         """Получает уведомление по событию и пользователю"""
-        session = self.db.get_session()
-        try:
-            event = session.query(Event).filter(Event.event_id == event_id).first()
-            notification = (
-                session.query(Notification)
-                .filter(
-                    Notification.event_id == event_id, Notification.token_id == event.token_id
-                )
-                .first()
-            )
-            logger.info(f"Успешно получено уведомление: {notification}")
-            if notification:
-                return notification
-            else:
-                logger.info(f"Уведомление для события {event_id} не найдено")
+        with self.db.ReadSession() as session:
+            try:
+                notification = session.execute(
+                    _GET_NOTIFICATION_STMT, {"event_id": event_id}
+                ).scalar_one_or_none()
+                if notification:
+                    logger.info("Успешно получено уведомление для события: %s", event_id)
+                    return notification
+                else:
+                    logger.info("Уведомление для события %s не найдено", event_id)
+                    return None
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении уведомления: {e}")
                 return None
-        except Exception as e:
-            logger.error(f"Ошибка при получении уведомления: {e}")
-            return None
-        finally:
-            session.close()
+
+    def get_notified_event_ids(self, event_ids: list[str]) -> set[str]:
+        """Возвращает id событий из списка, для которых уже есть уведомления"""
+        if not event_ids:
+            return set()
+        with self.db.ReadSession() as session:
+            try:
+                return set(
+                    session.execute(
+                        _GET_NOTIFIED_EVENT_IDS_STMT,
+                        {"event_ids": list(set(event_ids))},
+                    ).scalars()
+                )
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении уведомлений: {e}")
+                return set()
 
     def check_all_notifications_sent(self, event_ids: tuple[str], user_id: int) -> bool:
         """Проверяет, отправлены ли все уведомления для события"""
-        session = self.db.get_session()
-        try:
-            token_ids = [token.token_id for token in session.query(UserTokenLink).filter(UserTokenLink.user_id == user_id).all()]
-            
-            # Получаем количество уведомлений для указанных событий
-            notifications_count = (
-                session.query(Notification)
-                .filter(
-                    Notification.event_id.in_(event_ids),
-                    Notification.token_id.in_(token_ids),
-                )
-                .count()
-            )
-            # Проверяем что количество уведомлений равно количеству событий
-            if notifications_count != len(event_ids):
-                logger.info(
-                    f"Найдено {notifications_count} уведомлений из {len(event_ids)} событий"
+        if not event_ids:
+            return True
+        with self.db.ReadSession() as session:
+            try:
+                # Выбираем только id событий с отправленными уведомлениями
+                wanted_ids = set(event_ids)
+                sent_ids = set(
+                    session.execute(
+                        _GET_SENT_EVENT_IDS_STMT,
+                        {"event_ids": list(wanted_ids), "user_id": user_id},
+                    ).scalars()
                 )
-                return False
+                missing_ids = wanted_ids - sent_ids
+                if missing_ids:
+                    logger.info(
+                        "Не найдено уведомлений: %d из %d событий",
+                        len(missing_ids),
+                        len(wanted_ids),
+                    )
+                    return False
 
-            logger.info(f"Все уведомления найдены ({notifications_count} шт)")
-            return True
+                logger.info("Все уведомления найдены (%d шт)", len(sent_ids))
+                return True
 
-        except Exception as e:
-            logger.error(f"Ошибка при проверке уведомлений: {e}")
-            return False
-        finally:
-            session.close()
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при проверке уведомлений: {e}")
+                return False
 
-    def get_pending_notifications(self) -> Any:
-        """Получает все неотправленные уведомления"""
-        session = self.db.get_session()
-        try:
-            notifications = (
-                session.query(Notification).filter(Notification.is_sent == False).all()
-            )
-            logger.info(f"Успешно получены неотправленные уведомления: {notifications}")
-            return notifications
-        except Exception as e:
-            logger.error(f"Ошибка при получении уведомлений: {e}")
-            return []
-        finally:
-            session.close()
+    def get_pending_notifications(self) -> Iterator[Notification]:
+        """Постранично отдает неотправленные уведомления, не загружая их все в память"""
+        # Отдельная транзакционная сессия: scoped-сессию закроют другие запросы,
+        # а курсор stream_results в AUTOCOMMIT-сессии для чтения не работает
+        with self.db.new_session() as session:
+            try:
+                result = session.execute(
+                    _GET_PENDING_NOTIFICATIONS_STMT.execution_options(
+                        stream_results=True
+                    )
+                )
+                for notification in result.yield_per(500).scalars():
+                    yield notification
+            except SQLAlchemyError as e:
+                logger.error(f"Ошибка при получении уведомлений: {e}")
 
 
 class DatabaseQueries:
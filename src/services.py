@@ -1,20 +1,51 @@
+import asyncio
 import logging
-import json
-import pytz
-from datetime import datetime, timezone, timedelta
+import orjson
+from datetime import date, datetime, timezone, timedelta
 from typing import Dict, List, Tuple, Any, Optional, NamedTuple
 
-from aiogram.types import Message
 from aiogram.utils.markdown import hbold
 from aiogram import Bot
 
 from google_calendar_client import GoogleCalendarClient
 from queries import DatabaseQueries
-from utils import safe_parse_datetime
+from utils import parse_event_time
 
 # Инициализация логгера
 logger = logging.getLogger(__name__)
 
+# Жирные подписи полей встречи не меняются, поэтому размечаются один раз
+_B_EMAIL = hbold("Почта:")
+_B_NAME = hbold("Название:")
+_B_TIME = hbold("Время:")
+_B_LINK = hbold("Ссылка:")
+
+# Названия месяцев по номеру, без зависимости от локали strftime("%B")
+_RU_MONTHS = (
+    "Январь",
+    "Февраль",
+    "Март",
+    "Апрель",
+    "Май",
+    "Июнь",
+    "Июль",
+    "Август",
+    "Сентябрь",
+    "Октябрь",
+    "Ноябрь",
+    "Декабрь",
+)
+
+
+def _day_label(day: date) -> str:
+    """Форматирует дату как ДД.ММ.ГГГГ без разбора формата strftime"""
+    return f"{day.day:02d}.{day.month:02d}.{day.year}"
+
+
+def _time_range(start: datetime, end: datetime) -> str:
+    """Форматирует интервал встречи как ЧЧ:ММ - ЧЧ:ММ без разбора формата strftime"""
+    return f"{start.hour:02d}:{start.minute:02d} - {end.hour:02d}:{end.minute:02d}"
+
 
 # Создаем типизированные структуры данных для возвращаемых значений
 class TokenValidationResult(NamedTuple):
@@ -50,71 +81,34 @@ class EventService:
             limit=limit,
         )
 
-        # Фильтруем только онлайн-встречи и нормализуем даты
-        active_events = []
-        for event in events:
-            if "hangoutLink" not in event:
-                continue
-
-            start_dt = safe_parse_datetime(
-                event["start"]["dateTime"], event["start"]["timeZone"]
-            )
-            end_dt = safe_parse_datetime(
-                event["end"]["dateTime"], event["end"]["timeZone"]
-            )
-
-            event["start"]["dateTime"] = start_dt.isoformat()
-            event["end"]["dateTime"] = end_dt.isoformat()
-
-            if end_dt > time_min:
-                active_events.append(event)
+        # Клиент уже отбросил завершившиеся события, остается оставить онлайн-встречи
+        active_events = [event for event in events if "hangoutLink" in event]
+        for event in active_events:
+            # Нормализуем даты в часовой пояс события
+            event["start"]["dateTime"] = parse_event_time(event, "start").isoformat()
+            event["end"]["dateTime"] = parse_event_time(event, "end").isoformat()
 
         return active_events
 
     def group_events_by_day(
         self, events: List[Dict[str, Any]]
     ) -> Dict[str, List[Dict[str, Any]]]:
-        """Группирует события сначала по почте, а затем по дням"""
-        # Сначала группируем по почте
-        meetings_by_email: Dict[str, List[Dict[str, Any]]] = {}
-        
+        """Группирует события по дням за один проход"""
+        events_by_date: Dict[date, List[Dict[str, Any]]] = {}
         for event in events:
-            # Получаем email организатора или первого участника
-            email = None
-            if "organizer" in event and "email" in event["organizer"]:
-                email = event["organizer"]["email"]
-            elif "attendees" in event and event["attendees"] and "email" in event["attendees"][0]:
-                email = event["attendees"][0]["email"]
-            else:
-                # Если email не найден, используем "unknown"
-                email = "unknown"
-                
-            if email not in meetings_by_email:
-                meetings_by_email[email] = []
-                
-            meetings_by_email[email].append(event)
-        
-        # Теперь группируем по дням для каждой почты
-        meetings_by_day: Dict[str, List[Dict[str, Any]]] = {}
-        
-        for email, email_events in meetings_by_email.items():
-            for event in email_events:
-                start_time = event["start"].get("dateTime", event["start"].get("date"))
-                start_dt = safe_parse_datetime(start_time)
-                day_key = start_dt.strftime("%d.%m.%Y")
-                
-                if day_key not in meetings_by_day:
-                    meetings_by_day[day_key] = []
-                
-                meetings_by_day[day_key].append(event)
-        
-        return meetings_by_day
+            # Дата берется в часовом поясе события, как и время в сообщении
+            day = parse_event_time(event, "start").date()
+            events_by_date.setdefault(day, []).append(event)
+        # Дни упорядочены по дате: строки вида дд.мм.гггг сортируются неверно
+        return {
+            _day_label(day): events_by_date[day]
+            for day in sorted(events_by_date)
+        }
 
     def save_events(self, user_id: int, events: List[Dict[str, Any]]) -> None:
         """Сохраняет события в базу данных"""
-        for event in events:
-            self.db.events.save_event(user_id, event)
-            self.db.notifications.create_notification(event["id"])
+        self.db.events.save_events_bulk(user_id, events)
+        self.db.notifications.create_notifications([event["id"] for event in events])
 
     def check_deleted_events(
         self,
@@ -146,10 +140,18 @@ class NotificationService:
         notification = self.db.notifications.get_notification(event_id, user_id)
         return notification is not None
 
+    def get_notified_event_ids(self, event_ids: List[str], user_id: int) -> set:
+        """Возвращает id событий, для которых уведомления уже созданы"""
+        return self.db.notifications.get_notified_event_ids(event_ids)
+
     def create_notification(self, event_id: str, user_id: int) -> None:
         """Создает уведомление для события"""
         self.db.notifications.create_notification(event_id)
 
+    def create_notifications(self, event_ids: List[str], user_id: int) -> None:
+        """Создает уведомления для нескольких событий одним запросом"""
+        self.db.notifications.create_notifications(event_ids)
+
 
 class TokenService:
     """Сервис для работы с токенами"""
@@ -160,7 +162,7 @@ class TokenService:
     def validate_token_json(self, token_json: str) -> TokenValidationResult:
         """Проверяет валидность JSON-данных токена"""
         try:
-            token_data = json.loads(token_json)
+            token_data = orjson.loads(token_json)
 
             # Проверяем наличие необходимых полей
             if "token" not in token_data or "refresh_token" not in token_data:
@@ -175,14 +177,14 @@ class TokenService:
                 message="✅ Токен успешно сохранен! Теперь вы можете использовать команды /week и /check.",
                 token_data=token_data,
             )
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             return TokenValidationResult(
                 is_valid=False,
                 message="❌ Неверный формат JSON. Пожалуйста, проверьте данные и попробуйте снова.",
                 token_data=None,
             )
         except Exception as e:
-            logging.error(f"Ошибка при валидации токена: {e}")
+            logger.error("Ошибка при валидации токена: %s", e)
             return TokenValidationResult(
                 is_valid=False,
                 message=f"❌ Произошла ошибка: {str(e)}",
@@ -205,45 +207,23 @@ class StatisticsService:
         if not period:
             return "Ошибка: не указан период"
 
-        events = self.db.events.get_statistics(user_id, period)
-
-        # Считаем общее количество событий
-        total_events = len(events)
-
-        # Считаем общее время в минутах
-        total_minutes = sum(
-            (event.end_time - event.start_time).total_seconds() / 60 for event in events
+        # Количество встреч и общее время в минутах считаются в БД
+        total_events, total_minutes = self.db.events.get_statistics_aggregated(
+            user_id, period
         )
 
-        now = datetime.now(timezone.utc) - timedelta(
-            days=datetime.now(timezone.utc).weekday()
-        )
-
-        # Словарь для локализации названий месяцев
-        month_names = {
-            "January": "Январь",
-            "February": "Февраль",
-            "March": "Март",
-            "April": "Апрель",
-            "May": "Май",
-            "June": "Июнь",
-            "July": "Июль",
-            "August": "Август",
-            "September": "Сентябрь",
-            "October": "Октябрь",
-            "November": "Ноябрь",
-            "December": "Декабрь",
-        }
+        today = datetime.now(timezone.utc)
+        now = today - timedelta(days=today.weekday())
 
-        # Получаем название месяца и локализуем его
-        month_name = now.strftime("%B")
-        localized_month = month_names.get(month_name, month_name)
-
-        period_text = {
-            "week": f"неделю {now.strftime('%d.%m')} - {datetime.now(timezone.utc).strftime('%d.%m')}",
-            "month": f"{localized_month} {now.strftime('%Y')} года",
-            "year": f"{now.strftime('%Y')} год",
-        }.get(period, f"{period}")
+        # Формируем подпись только для запрошенного периода
+        if period == "week":
+            period_text = f"неделю {now.strftime('%d.%m')} - {today.strftime('%d.%m')}"
+        elif period == "month":
+            period_text = f"{_RU_MONTHS[now.month - 1]} {now.year} года"
+        elif period == "year":
+            period_text = f"{now.year} год"
+        else:
+            period_text = period
 
         statistics = (
             f"За {period_text}:\n"
@@ -263,22 +243,21 @@ class MessageFormatter:
     ) -> str:
         """Форматирует список событий на день"""
         prefix = "Обнаружены новые онлайн-встречи:\n" if is_new else ""
-        message = f"{prefix}📆 {hbold(f'Онлайн-встречи на {day}:')}\n"
+        # Части собираются в список и склеиваются один раз
+        parts = [f"{prefix}📆 {hbold(f'Онлайн-встречи на {day}:')}\n"]
         sorted_events = sorted(events, key=lambda x: x["token_email"])
         for event in sorted_events:
-            start_time = event["start"].get("dateTime", event["start"].get("date"))
-            start_dt = safe_parse_datetime(start_time, event["start"]["timeZone"])
-            end_time = event["end"].get("dateTime", event["end"].get("date"))
-            end_dt = safe_parse_datetime(end_time, event["end"]["timeZone"])
-
-            message += (
-                f"📧 {hbold('Почта:')} {event['token_email']}\n"
-                f"📝 {hbold('Название:')} {event['summary']}\n"
-                f"🕒 {hbold('Время:')} {start_dt.strftime('%H:%M')} - {end_dt.strftime('%H:%M')}\n"
-                f"🔗 {hbold('Ссылка:')} {event['hangoutLink']}\n\n"
+            start_dt = parse_event_time(event, "start")
+            end_dt = parse_event_time(event, "end")
+
+            parts.append(
+                f"📧 {_B_EMAIL} {event['token_email']}\n"
+                f"📝 {_B_NAME} {event['summary']}\n"
+                f"🕒 {_B_TIME} {_time_range(start_dt, end_dt)}\n"
+                f"🔗 {_B_LINK} {event['hangoutLink']}\n\n"
             )
 
-        return message
+        return "".join(parts)
 
     @staticmethod
     def format_deleted_events(deleted_events: List[Dict[str, Any]]) -> str:
@@ -287,27 +266,23 @@ class MessageFormatter:
             return ""
 
         # Группируем события по датам
-        events_by_date = {}
+        events_by_date: Dict[date, List[Dict[str, Any]]] = {}
         for event in deleted_events:
-            start_dt = event["start"]
-            day_key = start_dt.strftime("%d.%m.%Y")
-            if day_key not in events_by_date:
-                events_by_date[day_key] = []
-            events_by_date[day_key].append(event)
+            events_by_date.setdefault(event["start"].date(), []).append(event)
 
-        message = "Встречи были отменены:"
+        parts = ["Встречи были отменены:"]
 
         # Формируем сообщение по датам
-        for date in sorted(events_by_date.keys()):
-            message += f"\n📅 Онлайн встречи на {date}:\n"
-            for event in events_by_date[date]:
-                message += (
+        for day in sorted(events_by_date):
+            parts.append(f"\n📅 Онлайн встречи на {_day_label(day)}:\n")
+            for event in events_by_date[day]:
+                parts.append(
                     f"📧 Почта: {event['token_email']}\n"
                     f"🗑️ Название: {event['summary']}\n"
-                    f"🕒 Время: {event['start'].strftime('%H:%M')} - {event['end'].strftime('%H:%M')}\n"
+                    f"🕒 Время: {_time_range(event['start'], event['end'])}\n"
                 )
 
-        return message
+        return "".join(parts)
 
     @staticmethod
     def format_updated_events(updated_events: List[Dict[str, Any]]) -> str:
@@ -316,42 +291,27 @@ class MessageFormatter:
             return ""
 
         # Группируем события по датам
-        events_by_date = {}
+        events_by_date: Dict[date, List[Dict[str, Any]]] = {}
         for event in updated_events:
-            start_dt = event["start"]
-            day_key = start_dt.strftime("%d.%m.%Y")
-            if day_key not in events_by_date:
-                events_by_date[day_key] = []
-            events_by_date[day_key].append(event)
+            events_by_date.setdefault(event["start"].date(), []).append(event)
 
-        message = ""
+        parts = []
         # Формируем сообщение по датам
-        for date in sorted(events_by_date.keys()):
-            message += f"\n🔄 Встречи обновлена на дату: {date}\n"
-            for event in events_by_date[date]:
-                message += f"📧 Почта: {event['token_email']}\n"
-                message += "Было:\n"
-                message += f"📝 Название: {event['old_summary']}\n"
-
-                # Преобразуем строки в datetime
-                old_start = (
-                    safe_parse_datetime(event["old_start"])
-                    if isinstance(event["old_start"], str)
-                    else event["old_start"]
-                )
-                old_end = (
-                    safe_parse_datetime(event["old_end"])
-                    if isinstance(event["old_end"], str)
-                    else event["old_end"]
+        for day in sorted(events_by_date):
+            parts.append(f"\n🔄 Встречи обновлена на дату: {_day_label(day)}\n")
+            for event in events_by_date[day]:
+                parts.append(f"📧 Почта: {event['token_email']}\n")
+                parts.append("Было:\n")
+                parts.append(f"📝 Название: {event['old_summary']}\n")
+                parts.append(
+                    f"🕒 Время: {_time_range(event['old_start'], event['old_end'])}\n"
                 )
+                parts.append("Стало:\n")
+                parts.append(f"📝 Название: {event['summary']}\n")
+                parts.append(f"🕒 Время: {_time_range(event['start'], event['end'])}\n")
+                parts.append(f"🔗 Ссылка на встречу: {event['old_meet_link']}\n")
 
-                message += f"🕒 Время: {old_start.strftime('%H:%M')} - {old_end.strftime('%H:%M')}\n"
-                message += "Стало:\n"
-                message += f"📝 Название: {event['summary']}\n"
-                message += f"🕒 Время: {event['start'].strftime('%H:%M')} - {event['end'].strftime('%H:%M')}\n"
-                message += f"🔗 Ссылка на встречу: {event['old_meet_link']}\n"
-
-        return message
+        return "".join(parts)
 
 
 class BotService:
@@ -401,7 +361,35 @@ class BotService:
         if message:
             await self.bot.send_message(user_id, message)
 
-    async def get_week_meetings(self, user_id: int) -> WeekMeetingsResult:
+    @staticmethod
+    def _week_window() -> Tuple[datetime, datetime]:
+        """Возвращает окно встреч: от текущего момента до конца ближайшей пятницы"""
+        # Получаем текущее время в UTC для фильтрации только будущих встреч;
+        # без микросекунд граница окна стабильна между опросами и syncToken живет
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        # Определяем день недели (0 = понедельник, 6 = воскресенье)
+        weekday = now.weekday()
+
+        # Рассчитываем время окончания в зависимости от дня недели
+        if weekday < 5:  # Будни (пн-пт)
+            # Находим ближайшую пятницу
+            days_until_friday = 4 - weekday  # 4 = пятница
+            time_max = (now + timedelta(days=days_until_friday)).replace(
+                hour=23, minute=59, second=59, microsecond=0
+            )
+        else:  # Выходные (сб-вс)
+            # Находим пятницу следующей недели
+            days_until_next_friday = 5 + (
+                7 - weekday
+            )  # 5 дней до пятницы + дни до конца недели
+            time_max = (now + timedelta(days=days_until_next_friday)).replace(
+                hour=23, minute=59, second=59, microsecond=0
+            )
+        return now, time_max
+
+    async def get_week_meetings(
+        self, user_id: int, window: Optional[Tuple[datetime, datetime]] = None
+    ) -> WeekMeetingsResult:
         """Получает встречи на неделю и группирует их по дням"""
         try:
             # Проверяем наличие токена в базе данных
@@ -415,26 +403,7 @@ class BotService:
                     updated_events=[],
                 )
 
-            # Получаем текущее время в UTC для фильтрации только будущих встреч
-            now = datetime.now(timezone.utc)
-            # Определяем день недели (0 = понедельник, 6 = воскресенье)
-            weekday = now.weekday()
-
-            # Рассчитываем время окончания в зависимости от дня недели
-            if weekday < 5:  # Будни (пн-пт)
-                # Находим ближайшую пятницу
-                days_until_friday = 4 - weekday  # 4 = пятница
-                time_max = (now + timedelta(days=days_until_friday)).replace(
-                    hour=23, minute=59, second=59
-                )
-            else:  # Выходные (сб-вс)
-                # Находим пятницу следующей недели
-                days_until_next_friday = 5 + (
-                    7 - weekday
-                )  # 5 дней до пятницы + дни до конца недели
-                time_max = (now + timedelta(days=days_until_next_friday)).replace(
-                    hour=23, minute=59, second=59
-                )
+            now, time_max = window or self._week_window()
 
             # Запрашиваем события начиная с текущего момента до рассчитанной даты
             active_events = await self.event_service.get_upcoming_events(
@@ -470,7 +439,7 @@ class BotService:
             )
 
         except Exception as e:
-            logging.error(f"Ошибка при получении встреч на неделю: {e}")
+            logger.error("Ошибка при получении встреч на неделю: %s", e)
             return WeekMeetingsResult(
                 success=False,
                 message="Произошла ошибка при получении данных о встречах.",
@@ -482,34 +451,30 @@ class BotService:
 
     async def get_check_meetings(self, user_id: int) -> WeekMeetingsResult:
         """Проверяет встречи на неделю, включая удаленные и обновленные"""
-        result = await self.get_week_meetings(user_id)
+        # Окно считается один раз: проверки сверяют события того же периода
+        now, time_max = self._week_window()
+        result = await self.get_week_meetings(user_id, (now, time_max))
 
         if not result.success:
             return result
 
-        # Получаем текущее время в UTC
-        now = datetime.now(timezone.utc)
-        # Определяем день недели (0 = понедельник, 6 = воскресенье)
-        weekday = now.weekday()
-
-        # Рассчитываем время окончания
-        if weekday < 5:  # Будни (пн-пт)
-            days_until_friday = 4 - weekday
-            time_max = (now + timedelta(days=days_until_friday)).replace(
-                hour=23, minute=59, second=59
-            )
-        else:  # Выходные (сб-вс)
-            days_until_next_friday = 5 + (7 - weekday)
-            time_max = (now + timedelta(days=days_until_next_friday)).replace(
-                hour=23, minute=59, second=59
-            )
-
-        # Проверяем удаленные и обновленные события
-        deleted_events = self.event_service.check_deleted_events(
-            user_id, result.active_events, now, time_max
-        )
-        updated_events = self.event_service.check_updated_events(
-            user_id, result.active_events
+        # Проверки затрагивают разные строки, поэтому идут параллельно вне event loop
+        loop = asyncio.get_running_loop()
+        deleted_events, updated_events = await asyncio.gather(
+            loop.run_in_executor(
+                None,
+                self.event_service.check_deleted_events,
+                user_id,
+                result.active_events,
+                now,
+                time_max,
+            ),
+            loop.run_in_executor(
+                None,
+                self.event_service.check_updated_events,
+                user_id,
+                result.active_events,
+            ),
         )
         return WeekMeetingsResult(
             success=result.success,
@@ -526,22 +491,41 @@ class BotService:
         meetings_by_day: dict,
     ) -> None:
         """Отправляет сообщения о новых встречах, сгруппированных по дням"""
-        for day, day_events in sorted(meetings_by_day.items()):
-            new_events = []
-
-            for event in day_events:
-                # Проверяем, есть ли уже уведомление для этого события
-                if not self.notification_service.has_notification(event["id"], user_id):
-                    new_events.append(event)
-                    # Создаем уведомление для нового события
-                    self.notification_service.create_notification(event["id"], user_id)
+        loop = asyncio.get_running_loop()
+        # Уведомления по всем дням проверяем одним запросом вне event loop
+        event_ids = [
+            event["id"]
+            for day_events in meetings_by_day.values()
+            for event in day_events
+        ]
+        notified_ids = await loop.run_in_executor(
+            None, self.notification_service.get_notified_event_ids, event_ids, user_id
+        )
+        # Дни уже упорядочены по дате в group_events_by_day
+        new_ids: List[str] = []
+        messages = []
+        for day, day_events in meetings_by_day.items():
+            new_events = [
+                event for event in day_events if event["id"] not in notified_ids
+            ]
 
             # Отправляем сообщение только если есть новые события
             if new_events:
-                day_message = self.message_formatter.format_events_by_day(
-                    day, new_events, is_new=True
+                new_ids.extend(event["id"] for event in new_events)
+                messages.append(
+                    self.message_formatter.format_events_by_day(
+                        day, new_events, is_new=True
+                    )
                 )
-                await self.bot.send_message(user_id, day_message, parse_mode="HTML")
+        if not new_ids:
+            return
+        # Уведомления всех дней создаются одним запросом параллельно с отправкой
+        await asyncio.gather(
+            loop.run_in_executor(
+                None, self.notification_service.create_notifications, new_ids, user_id
+            ),
+            self._send_in_order(user_id, messages),
+        )
 
     async def send_meetings_week_by_day(
         self,
@@ -549,10 +533,24 @@ class BotService:
         meetings_by_day: dict,
     ) -> None:
         """Отправляет сообщения со всеми встречами, сгруппированными по дням"""
-        for day, day_events in sorted(meetings_by_day.items()):
-            # Сохраняем все события в базу данных
-            self.event_service.save_events(user_id, day_events)
+        # Сохраняем события всех дней одной пачкой вне event loop
+        events = [
+            event for day_events in meetings_by_day.values() for event in day_events
+        ]
+        # Дни уже упорядочены по дате в group_events_by_day
+        messages = [
+            self.message_formatter.format_events_by_day(day, day_events)
+            for day, day_events in meetings_by_day.items()
+        ]
+        # Запись в БД не влияет на текст сообщений, поэтому идет параллельно с отправкой
+        await asyncio.gather(
+            asyncio.get_running_loop().run_in_executor(
+                None, self.event_service.save_events, user_id, events
+            ),
+            self._send_in_order(user_id, messages),
+        )
 
-            # Форматируем и отправляем сообщение
-            day_message = self.message_formatter.format_events_by_day(day, day_events)
-            await self.bot.send_message(user_id, day_message, parse_mode="HTML")
+    async def _send_in_order(self, user_id: int, messages: List[str]) -> None:
+        """Отправляет сообщения по одному, чтобы дни не перепутались в чате"""
+        for message in messages:
+            await self.bot.send_message(user_id, message, parse_mode="HTML")
@@ -1,30 +1,138 @@
+import hashlib
 import logging
+import threading
+import time
 import pytz
+from collections import OrderedDict
 from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Hashable, Optional
 
 
-def safe_parse_datetime(date_str: str, target_tz: str = "UTC") -> datetime:
+# Признак отсутствия значения в кэше (None может быть закэшированным результатом)
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением времени жизни записей"""
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Возвращает значение, если оно есть и не устарело"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые старые записи при переполнении"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """Удаляет значение из кэша"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Очищает кэш"""
+        with self._lock:
+            self._data.clear()
+
+
+def event_content_hash(event: dict) -> str:
+    """Считает короткий хэш полей события, по которым определяется его изменение"""
+    start = event.get("start", {})
+    end = event.get("end", {})
+    payload = "|".join(
+        (
+            event.get("summary", ""),
+            start.get("dateTime") or start.get("date") or "",
+            end.get("dateTime") or end.get("date") or "",
+            event.get("hangoutLink") or "",
+        )
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=8).hexdigest()
+
+
+@lru_cache(maxsize=64)
+def _get_timezone(name: str) -> Any:
+    """Возвращает объект часового пояса; UTC не требует обращения к pytz"""
+    if name == "UTC":
+        return timezone.utc
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=4096)
+def _parse_datetime(date_str: str, target_tz: str) -> datetime:
+    """Парсит строку даты; результат кэшируется, так как при опросе строки повторяются"""
+    if date_str.endswith("Z"):
+        date_str = date_str[:-1] + "+00:00"
+    dt = datetime.fromisoformat(date_str)
+    # Строка без смещения (в том числе дата без времени) считается временем в UTC
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+
+    if target_tz:
+        # Конвертируем в целевой часовой пояс если он задан
+        return dt.astimezone(_get_timezone(target_tz))
+
+    return dt.astimezone(timezone.utc)
+
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """Приводит datetime к naive UTC, в котором время событий хранится в БД"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def from_naive_utc(dt: datetime, target_tz: str = "UTC") -> datetime:
+    """Переводит naive UTC из БД в часовой пояс события"""
+    aware = dt.replace(tzinfo=timezone.utc)
+    try:
+        return aware.astimezone(_get_timezone(target_tz))
+    except pytz.UnknownTimeZoneError:
+        logging.error("Неизвестный часовой пояс %s", target_tz)
+        return aware
+
+
+def safe_parse_datetime(date_str: Optional[str], target_tz: str = "UTC") -> datetime:
     """
     Безопасно парсит строку даты в объект datetime
     Args:
-        date_str: строка с датой
+        date_str: строка с датой; для None возвращается текущее время
         target_tz: целевой часовой пояс (например 'Europe/Moscow')
     """
+    if not date_str:
+        logging.error("Ошибка при парсинге даты: пустое значение")
+        return datetime.now(timezone.utc)
     try:
-        if date_str.endswith("Z"):
-            dt = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
-        elif "+" in date_str or "-" in date_str and "T" in date_str:
-            dt = datetime.fromisoformat(date_str)
-        else:
-            dt = datetime.fromisoformat(date_str).replace(tzinfo=timezone.utc)
-
-        if target_tz:
-            # Конвертируем в целевой часовой пояс если он задан
-            target_timezone = pytz.timezone(target_tz)
-            return dt.astimezone(target_timezone)
-
-        return dt.astimezone(timezone.utc)
-
-    except Exception as e:
-        logging.error(f"Ошибка при парсинге даты {date_str}: {e}")
+        return _parse_datetime(date_str, target_tz)
+    except (AttributeError, TypeError, ValueError, pytz.UnknownTimeZoneError) as e:
+        # Ловим только ошибки входных данных: пустое значение, неверная строка или пояс.
+        # Ошибки не кэшируются: для некорректной строки всегда возвращается текущее время
+        logging.error("Ошибка при парсинге даты %s: %s", date_str, e)
         return datetime.now(timezone.utc)
+
+
+def parse_event_time(event: dict, key: str) -> datetime:
+    """Парсит время начала или конца события; у событий на весь день берется дата"""
+    value = event.get(key) or {}
+    return safe_parse_datetime(
+        value.get("dateTime") or value.get("date"), value.get("timeZone") or "UTC"
+    )